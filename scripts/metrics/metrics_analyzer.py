@@ -8,13 +8,190 @@ TrevanBox 高级度量分析工具
 import os
 import json
 import re
+import time
+import mmap
+import codecs
+import posixpath
+import sqlite3
 import datetime
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import argparse
 
+# frontmatter、wikilink和字数的匹配规则
+FRONTMATTER_RE = re.compile(r'^---\n.*?\n---', re.DOTALL)
+WIKILINK_RE = re.compile(r'\[\[([^\]]+)\]\]')
+WORD_RE = re.compile(r'[\u4e00-\u9fff]|[A-Za-z0-9]+')
+HEADING_RE = re.compile(r'^#{1,6}[ \t]+(.+?)[ \t]*$', re.MULTILINE)
+ALIASES_RE = re.compile(r'^(?:aliases|alias):[ \t]*(.*)$')
+ALIAS_ITEM_RE = re.compile(r'^\s*-\s+(.*)$')
+
+# 与上面等价的UTF-8字节规则：]和ASCII字母数字不会出现在多字节字符内部，
+# U+4E00-U+9FFF编码为E4 B8 80 - E9 BF BF三个字节
+WIKILINK_BYTES_RE = re.compile(rb'\[\[([^\]]+)\]\]')
+WORD_BYTES_RE = re.compile(rb'\xe4[\xb8-\xbf][\x80-\xbf]|[\xe5-\xe9][\x80-\xbf][\x80-\xbf]|[A-Za-z0-9]+')
+HEADING_BYTES_RE = re.compile(rb'^#{1,6}[ \t]+(.+?)[ \t]*\r?$', re.MULTILINE)
+FRONTMATTER_OPEN_RE = re.compile(rb'---(?:\r\n|\r|\n)')
+# 既不是字母数字也不是UTF-8后续字节的位置，字数匹配不会跨过它
+WORD_BOUNDARY_BYTES_RE = re.compile(rb'[^A-Za-z0-9\x80-\xbf]')
+# UTF-8校验和分块统计字数的分块大小
+UTF8_CHUNK_SIZE = 1024 * 1024
+WORD_CHUNK_SIZE = 256 * 1024
+
+# 指向这些扩展名的链接是附件，不参与笔记链接图谱
+ATTACHMENT_EXTENSIONS = {
+    "png", "jpg", "jpeg", "gif", "svg", "webp", "bmp", "pdf", "mp3", "mp4", "m4a", "wav", "ogg",
+    "webm", "mov", "canvas", "excalidraw", "csv", "xlsx", "docx", "pptx", "zip", "html",
+}
+
+@dataclass
+class FileFacts:
+    """单个markdown文件的派生统计"""
+    has_frontmatter: bool
+    link_count: int
+    word_count: int
+    links: List[str] = field(default_factory=list)  # [[...]]中的原始文本
+    aliases: List[str] = field(default_factory=list)  # frontmatter中的aliases
+    headings: List[str] = field(default_factory=list)
+
+def parse_aliases(frontmatter: str) -> List[str]:
+    """从frontmatter中解析aliases，支持行内列表、块列表和单个值"""
+    aliases = []
+    lines = frontmatter.splitlines()
+    for i, line in enumerate(lines):
+        match = ALIASES_RE.match(line)
+        if not match:
+            continue
+        value = match.group(1).strip()
+        if value.startswith('['):
+            aliases.extend(item.strip().strip('"\'') for item in value.strip('[]').split(','))
+        elif value:
+            aliases.append(value.strip('"\''))
+        else:
+            for item in lines[i + 1:]:
+                item_match = ALIAS_ITEM_RE.match(item)
+                if not item_match:
+                    break
+                aliases.append(item_match.group(1).strip().strip('"\''))
+    return [alias for alias in aliases if alias]
+
+def extract_text_facts(path: str) -> FileFacts:
+    """按文本读取文件并提取统计
+
+    不是有效UTF-8的文件与预处理器一样按GB18030（GB2312、GBK的超集）解码，
+    换行符按文本模式的规则统一为LF。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        content = data.decode('utf-8')
+    except UnicodeDecodeError:
+        content = data.decode('gb18030', errors='replace')
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    frontmatter = FRONTMATTER_RE.match(content)
+    links = WIKILINK_RE.findall(content)
+    return FileFacts(bool(frontmatter), len(links), len(WORD_RE.findall(content)), links,
+                     parse_aliases(frontmatter.group()) if frontmatter else [],
+                     HEADING_RE.findall(content))
+
+def is_utf8(data) -> bool:
+    """分块校验是否为有效UTF-8
+
+    纯ASCII的分块只在解码器没有未完成的多字节序列时跳过，否则跨块的非法序列会被漏掉。
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for start in range(0, len(data), UTF8_CHUNK_SIZE):
+            chunk = data[start:start + UTF8_CHUNK_SIZE]
+            if not chunk.isascii() or decoder.getstate()[0]:
+                decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def find_frontmatter_bytes(data) -> Optional[bytes]:
+    """字节版frontmatter检查，返回两条分隔线之间的内容，没有frontmatter时返回None
+
+    文本模式读取会把CRLF和单独的CR转换为LF，这里按同样的规则识别换行；找到结束标记即停止。
+    """
+    opening = FRONTMATTER_OPEN_RE.match(data)
+    if not opening:
+        return None
+    start = opening.end()
+    end = data.find(b"\n---", start)
+    cr_end = data.find(b"\r---", start, len(data) if end == -1 else end)
+    if cr_end != -1:
+        end = cr_end
+    return data[start:end] if end != -1 else None
+
+def count_words_bytes(data) -> int:
+    """分块统计字数，每块在匹配边界处切开，内存占用与文件大小无关"""
+    count = 0
+    start = 0
+    while start < len(data):
+        boundary = WORD_BOUNDARY_BYTES_RE.search(data, min(start + WORD_CHUNK_SIZE, len(data)))
+        end = boundary.start() if boundary else len(data)
+        count += len(WORD_BYTES_RE.findall(data, start, end))
+        start = end
+    return count
+
+def newline_text(data: bytes) -> str:
+    """解码UTF-8片段并按文本模式的规则把CRLF和CR转换为LF"""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+def extract_file_facts(path: str) -> FileFacts:
+    """读取文件并提取统计
+
+    字数按每个汉字计一个字、连续的字母数字计一个词。UTF-8文件通过mmap在字节上直接匹配，
+    不解码为str，结果与文本读取完全一致；其他编码的文件退回文本读取，按GB18030解码。
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return FileFacts(False, 0, 0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if is_utf8(data):
+                    frontmatter = find_frontmatter_bytes(data)
+                    links = [newline_text(match.group(1)) for match in WIKILINK_BYTES_RE.finditer(data)]
+                    return FileFacts(
+                        frontmatter is not None, len(links),
+                        count_words_bytes(data), links,
+                        parse_aliases(frontmatter.decode('utf-8')) if frontmatter is not None else [],
+                        [match.group(1).split(b'\r', 1)[0].rstrip(b' \t').decode('utf-8')
+                         for match in HEADING_BYTES_RE.finditer(data)])
+    except (OSError, ValueError):
+        pass  # 不支持mmap的文件系统
+    return extract_text_facts(path)
+
+def extract_batch_facts(paths: List[str]) -> List[FileFacts]:
+    """批量提取文件统计（供进程池调用，须为模块级函数）"""
+    return [extract_file_facts(path) for path in paths]
+
+def normalize_note_key(text: str) -> str:
+    """笔记的匹配键：小写、统一为/分隔、去掉.md扩展名"""
+    key = text.strip().replace('\\', '/').lstrip('/').lower()
+    return key[:-3] if key.endswith('.md') else key
+
+def normalize_heading(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+def parse_wikilink(text: str) -> Optional[Tuple[str, str, str]]:
+    """把[[...]]中的文本解析为 (目标原文, 匹配键, 标题锚点)，附件链接返回None
+
+    支持 [[笔记]]、[[目录/笔记]]、[[笔记#标题]]、[[笔记|显示文字]]、[[#本文标题]]。
+    """
+    target = text.split('|', 1)[0].rstrip('\\')
+    target, _, anchor = target.partition('#')
+    key = normalize_note_key(target)
+    if posixpath.splitext(key)[1][1:] in ATTACHMENT_EXTENSIONS:
+        return None
+    # 嵌套标题 [[笔记#一级#二级]] 按最后一级匹配
+    return target.strip(), key, normalize_heading(anchor.split('#')[-1]) if anchor else ""
+
 @dataclass
 class SystemMetrics:
     """系统度量数据结构"""
@@ -27,12 +204,300 @@ class SystemMetrics:
     content_quality: Dict[str, float]
     efficiency_metrics: Dict[str, float]
     growth_metrics: Dict[str, float]
+    link_graph: Dict[str, float] = field(default_factory=dict)
+
+@dataclass
+class VaultScan:
+    """一次遍历收集到的文件信息，供各项度量共用"""
+    category_counts: Dict[str, int] = field(default_factory=dict)  # 各PARA类别的markdown文件数
+    category_sizes: Dict[str, int] = field(default_factory=dict)  # 各PARA类别所有文件的总字节数
+    pending_count: int = 0
+    oldest_pending_mtime: Optional[float] = None
+    # 参与内容质量分析的markdown文件（不含0-Inbox）：(路径, 相对路径, 修改时间, 大小)
+    markdown_files: List[Tuple[str, str, float, int]] = field(default_factory=list)
+    # 0-Inbox中的markdown文件，只参与链接图谱
+    inbox_files: List[Tuple[str, str, float, int]] = field(default_factory=list)
+
+class FileStatIndex:
+    """文件统计索引：按相对路径、大小和修改时间缓存每个markdown文件的派生统计（SQLite）
+
+    大小和修改时间都未变化的文件直接使用索引中的结果，不再读取全文。
+    同时保存每篇笔记的aliases、标题和[[链接]]，供LinkGraph使用。
+    """
+
+    # 统计口径变化时递增，旧索引会被清空重建
+    VERSION = 4
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            has_frontmatter INTEGER NOT NULL,
+            link_count INTEGER NOT NULL,
+            word_count INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            aliases TEXT NOT NULL,
+            headings TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS files_key ON files(key)",
+        "CREATE INDEX IF NOT EXISTS files_name ON files(name)",
+        # target为解析到的笔记id（NULL为断链）；anchor_ok：1标题存在，0标题不存在，NULL无标题锚点
+        """CREATE TABLE IF NOT EXISTS links (
+            source INTEGER NOT NULL,
+            raw TEXT NOT NULL,
+            key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            anchor TEXT NOT NULL,
+            target INTEGER,
+            anchor_ok INTEGER
+        )""",
+        "CREATE INDEX IF NOT EXISTS links_source ON links(source)",
+        "CREATE INDEX IF NOT EXISTS links_target ON links(target)",
+        "CREATE INDEX IF NOT EXISTS links_name ON links(name)",
+        "CREATE INDEX IF NOT EXISTS links_key ON links(key)",
+    ]
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute("DROP TABLE IF EXISTS links")
+            self.conn.execute(f"PRAGMA user_version = {self.VERSION}")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def load(self) -> Dict[str, Tuple[int, float, bool, int, int]]:
+        """读取全部记录：相对路径 -> (大小, 修改时间, 有frontmatter, 链接数, 字数)"""
+        rows = self.conn.execute(
+            "SELECT path, size, mtime, has_frontmatter, link_count, word_count FROM files")
+        return {path: (size, mtime, bool(has_frontmatter), link_count, word_count)
+                for path, size, mtime, has_frontmatter, link_count, word_count in rows}
+
+    def update(self, rows: List[Tuple[str, int, float, str, FileFacts]], removed: List[str]):
+        """写入重新统计的文件，删除已不存在的文件，并重新解析受影响的链接"""
+        if not rows and not removed:
+            return
+        existing = {path: (file_id, name, aliases) for file_id, path, name, aliases
+                    in self.conn.execute("SELECT id, path, name, aliases FROM files")}
+        changed_ids = set()
+        affected_names = set()
+        affected_keys = set()
+        with self.conn:
+            for path in removed:
+                file_id, name, aliases = existing[path]
+                changed_ids.add(file_id)
+                affected_names.add(name)
+                affected_keys.update(json.loads(aliases))
+                self.conn.execute("DELETE FROM links WHERE source = ?", (file_id,))
+                self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+            for path, size, mtime, category, facts in rows:
+                key = normalize_note_key(path.replace(os.sep, '/'))
+                name = key.rsplit('/', 1)[-1]
+                aliases = sorted({normalize_note_key(alias) for alias in facts.aliases})
+                headings = sorted({normalize_heading(heading) for heading in facts.headings})
+                values = (size, mtime, facts.has_frontmatter, facts.link_count, facts.word_count, category,
+                          json.dumps(aliases, ensure_ascii=False), json.dumps(headings, ensure_ascii=False))
+                if path in existing:
+                    file_id, _, old_aliases = existing[path]
+                    affected_keys.update(json.loads(old_aliases))
+                    self.conn.execute(
+                        """UPDATE files SET size = ?, mtime = ?, has_frontmatter = ?, link_count = ?,
+                                            word_count = ?, category = ?, aliases = ?, headings = ?
+                           WHERE id = ?""", values + (file_id,))
+                    self.conn.execute("DELETE FROM links WHERE source = ?", (file_id,))
+                else:
+                    affected_names.add(name)
+                    file_id = self.conn.execute(
+                        """INSERT INTO files (size, mtime, has_frontmatter, link_count, word_count, category,
+                                              aliases, headings, path, key, name)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", values + (path, key, name)).lastrowid
+                changed_ids.add(file_id)
+                affected_keys.update(aliases)
+                links = [parsed for parsed in map(parse_wikilink, facts.links) if parsed]
+                self.conn.executemany(
+                    "INSERT INTO links (source, raw, key, name, anchor) VALUES (?, ?, ?, ?, ?)",
+                    [(file_id, raw, key, key.rsplit('/', 1)[-1], anchor) for raw, key, anchor in links])
+
+            LinkGraph(self.conn).resolve(changed_ids, affected_names, affected_keys)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM links")
+
+    def close(self):
+        self.conn.close()
+
+class LinkGraph:
+    """wikilink链接图谱：节点为笔记，边为解析后的[[链接]]，数据保存在FileStatIndex中
+
+    链接按以下顺序解析（不区分大小写）：仓库内完整路径、相对当前笔记的路径、
+    文件名（路径后缀）、frontmatter中的aliases。同名笔记优先选择同一目录下的，
+    其次是路径最短的。带标题锚点的链接还会检查目标笔记中是否存在该标题。
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def resolve(self, changed_ids: set, affected_names: set, affected_keys: set):
+        """重新解析受变化影响的链接：来自或指向变化笔记的链接、以变化笔记的文件名或别名为目标的链接"""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_ids (id INTEGER PRIMARY KEY)")
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_names (name TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_keys (key TEXT PRIMARY KEY)")
+        for table in ("affected_ids", "affected_names", "affected_keys"):
+            self.conn.execute(f"DELETE FROM {table}")
+        self.conn.executemany("INSERT INTO affected_ids VALUES (?)", [(i,) for i in changed_ids])
+        self.conn.executemany("INSERT INTO affected_names VALUES (?)", [(n,) for n in affected_names])
+        self.conn.executemany("INSERT INTO affected_keys VALUES (?)", [(k,) for k in affected_keys])
+        pending = self.conn.execute("""
+            SELECT links.rowid, links.source, files.key, links.key, links.name, links.anchor
+            FROM links JOIN files ON files.id = links.source
+            WHERE links.source IN (SELECT id FROM affected_ids)
+               OR links.target IN (SELECT id FROM affected_ids)
+               OR links.name IN (SELECT name FROM affected_names)
+               OR links.key IN (SELECT key FROM affected_keys)
+        """).fetchall()
+        if not pending:
+            return
+
+        by_key = {}
+        by_name = defaultdict(list)
+        by_alias = defaultdict(list)
+        for file_id, key, name, aliases in self.conn.execute("SELECT id, key, name, aliases FROM files"):
+            by_key[key] = file_id
+            by_name[name].append((key, file_id))
+            for alias in json.loads(aliases):
+                by_alias[alias].append((key, file_id))
+
+        headings = {}
+        updates = []
+        for rowid, source, source_key, key, name, anchor in pending:
+            target = self._resolve_target(source, source_key, key, name, by_key, by_name, by_alias)
+            anchor_ok = None
+            if target is not None and anchor and not anchor.startswith('^'):  # ^开头为块引用，不检查
+                if target not in headings:
+                    row = self.conn.execute("SELECT headings FROM files WHERE id = ?", (target,)).fetchone()
+                    headings[target] = set(json.loads(row[0]))
+                anchor_ok = int(anchor in headings[target])
+            updates.append((target, anchor_ok, rowid))
+        self.conn.executemany("UPDATE links SET target = ?, anchor_ok = ? WHERE rowid = ?", updates)
+
+    @staticmethod
+    def _resolve_target(source: int, source_key: str, key: str, name: str, by_key: Dict[str, int],
+                        by_name: Dict[str, List[Tuple[str, int]]],
+                        by_alias: Dict[str, List[Tuple[str, int]]]) -> Optional[int]:
+        if not key:
+            return source  # [[#标题]]指向当前笔记
+        if '/' in key:
+            if key in by_key:
+                return by_key[key]
+            relative = posixpath.normpath(posixpath.join(posixpath.dirname(source_key), key))
+            if relative in by_key:
+                return by_key[relative]
+            candidates = [c for c in by_name.get(name, []) if c[0].endswith('/' + key)]
+        else:
+            candidates = by_name.get(name, [])
+        candidates = candidates or by_alias.get(key, [])
+        if not candidates:
+            return None
+        source_dir = posixpath.dirname(source_key)
+        return min(candidates, key=lambda c: (posixpath.dirname(c[0]) != source_dir, c[0].count('/'), c[0]))[1]
+
+    def _find_notes(self, note: str) -> List[int]:
+        """按路径或文件名查找笔记"""
+        key = normalize_note_key(note)
+        rows = self.conn.execute("SELECT id FROM files WHERE key = ?", (key,)).fetchall() or \
+            self.conn.execute("SELECT id FROM files WHERE name = ?", (key.rsplit('/', 1)[-1],)).fetchall()
+        return [row[0] for row in rows]
+
+    def backlinks(self, note: str) -> List[str]:
+        """链接到指定笔记的其他笔记"""
+        ids = self._find_notes(note)
+        if not ids:
+            return []
+        rows = self.conn.execute(f"""
+            SELECT DISTINCT files.path FROM links JOIN files ON files.id = links.source
+            WHERE links.target IN ({','.join('?' * len(ids))}) AND links.source != links.target
+            ORDER BY files.path
+        """, ids)
+        return [row[0] for row in rows]
+
+    def orphans(self) -> List[str]:
+        """既没有链接到其他笔记、也没有被其他笔记链接的孤立笔记"""
+        rows = self.conn.execute("""
+            SELECT path FROM files
+            WHERE NOT EXISTS (SELECT 1 FROM links WHERE links.source = files.id
+                              AND links.target IS NOT NULL AND links.target != files.id)
+              AND NOT EXISTS (SELECT 1 FROM links WHERE links.target = files.id AND links.source != files.id)
+            ORDER BY path
+        """)
+        return [row[0] for row in rows]
+
+    def broken_links(self, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """断链和失效的标题锚点：(所在笔记, 链接原文)"""
+        rows = self.conn.execute("""
+            SELECT files.path, links.raw, links.anchor, links.target FROM links JOIN files ON files.id = links.source
+            WHERE links.target IS NULL OR links.anchor_ok = 0
+            ORDER BY files.path, links.rowid
+            LIMIT ?
+        """, (-1 if limit is None else limit,))
+        return [(path, raw if target is None else f"{raw}#{anchor}") for path, raw, anchor, target in rows]
+
+    def hubs(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """反向链接最多的笔记：(路径, 链接到它的笔记数)"""
+        rows = self.conn.execute("""
+            SELECT files.path, COUNT(DISTINCT links.source) AS backlinks
+            FROM links JOIN files ON files.id = links.target
+            WHERE links.source != links.target
+            GROUP BY links.target
+            ORDER BY backlinks DESC, files.path
+            LIMIT ?
+        """, (limit,))
+        return rows.fetchall()
+
+    def stats(self) -> Dict[str, float]:
+        """图谱统计：笔记数、链接数、断链数、孤立笔记等"""
+        notes = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        links, resolved, broken_anchors = self.conn.execute(
+            "SELECT COUNT(*), COUNT(target), COALESCE(SUM(anchor_ok = 0), 0) FROM links").fetchone()
+        edges = self.conn.execute("""
+            SELECT COUNT(*) FROM (SELECT DISTINCT source, target FROM links
+                                  WHERE target IS NOT NULL AND target != source)
+        """).fetchone()[0]
+        orphans = len(self.orphans())
+        return {
+            "notes": notes,
+            "links": links,
+            "resolved_links": resolved,
+            "broken_links": links - resolved,
+            "broken_anchors": broken_anchors,
+            "edges": edges,
+            "orphan_notes": orphans,
+            "orphan_ratio": (orphans / notes * 100) if notes > 0 else 0,
+            "resolved_ratio": (resolved / links * 100) if links > 0 else 100,
+            "avg_backlinks": (edges / notes) if notes > 0 else 0,
+        }
 
 class TrevanBoxMetricsAnalyzer:
     """TrevanBox 度量分析器"""
 
-    def __init__(self, base_path: str = "."):
+    def __init__(self, base_path: str = ".", use_index: bool = True, rebuild_index: bool = False,
+                 jobs: int = 1, pool: str = "process"):
         self.base_path = Path(base_path)
+        # 并行读取文件：process适合本地磁盘（正则匹配占CPU），thread适合网络挂载等I/O受限的场景
+        self.jobs = max(1, jobs)
+        self.pool = pool
+        # 文件统计索引，位于仓库根目录的.trevanbox下（与AI预处理器的状态目录相同）
+        self.use_index = use_index
+        self.rebuild_index = rebuild_index
+        self.index_path = self.base_path / ".trevanbox" / "metrics_index.db"
         # 修复：根据PARA方法论，将报告存储在Personal-Growth领域
         current_year = datetime.datetime.now().year
         self.reports_dir = self.base_path / "2-Areas" / "Personal-Growth" / "review" / str(current_year) / "metrics"
@@ -51,12 +516,23 @@ class TrevanBoxMetricsAnalyzer:
         """分析系统状态，返回度量数据"""
         print("[TrevanBox] 开始分析系统状态...")
 
+        # 只遍历一次目录树，各项度量共用扫描结果
+        scan = self._scan_vault()
+
         # 基础统计
-        para_stats = self._analyze_para_distribution()
-        pending_stats = self._analyze_pending_items()
+        para_stats = self._analyze_para_distribution(scan)
+        pending_stats = self._analyze_pending_items(scan)
 
-        # 内容质量分析
-        content_quality = self._analyze_content_quality()
+        index = self._open_index()
+        try:
+            # 内容质量分析
+            content_quality = self._analyze_content_quality(scan, index)
+
+            # 链接图谱分析
+            link_graph = self._analyze_link_graph(index)
+        finally:
+            if index:
+                index.close()
 
         # 效率指标分析
         efficiency_metrics = self._analyze_efficiency()
@@ -76,13 +552,65 @@ class TrevanBoxMetricsAnalyzer:
             overall_health=overall_health,
             content_quality=content_quality,
             efficiency_metrics=efficiency_metrics,
-            growth_metrics=growth_metrics
+            growth_metrics=growth_metrics,
+            link_graph=link_graph
         )
 
         print(f"[TrevanBox] 分析完成，总体健康度: {overall_health:.1f}/100")
         return metrics
 
-    def _analyze_para_distribution(self) -> Dict[str, Dict[str, float]]:
+    def _scan_vault(self) -> VaultScan:
+        """用os.scandir遍历一次目录树，收集各项度量需要的文件数、大小和修改时间
+
+        与原先的glob/rglob一致：不进入指向目录的符号链接，指向文件的符号链接按目标文件统计。
+        """
+        print("[TrevanBox] 扫描文件...")
+
+        scan = VaultScan()
+        pending_prefix = os.path.join("0-Inbox", "pending") + os.sep
+        # 栈中保存 (目录路径, 相对base_path的路径)
+        stack = [(str(self.base_path), "")]
+        while stack:
+            dir_path, rel_dir = stack.pop()
+            try:
+                with os.scandir(dir_path) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, rel_path))
+                        continue
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                category = rel_path.split(os.sep, 1)[0] if os.sep in rel_path else None
+                if category in self.para_config:
+                    scan.category_sizes[category] = scan.category_sizes.get(category, 0) + stat.st_size
+                if not entry.name.endswith(".md"):
+                    continue
+
+                if category in self.para_config:
+                    scan.category_counts[category] = scan.category_counts.get(category, 0) + 1
+                if rel_path.startswith(pending_prefix):
+                    scan.pending_count += 1
+                    if scan.oldest_pending_mtime is None or stat.st_mtime < scan.oldest_pending_mtime:
+                        scan.oldest_pending_mtime = stat.st_mtime
+                files = scan.inbox_files if "0-Inbox" in entry.path else scan.markdown_files
+                files.append((entry.path, rel_path, stat.st_mtime, stat.st_size))
+
+        # 按路径排序，使后续统计与遍历顺序无关
+        scan.markdown_files.sort()
+        scan.inbox_files.sort()
+        return scan
+
+    def _analyze_para_distribution(self, scan: VaultScan) -> Dict[str, Dict[str, float]]:
         """分析PARA分布"""
         print("[TrevanBox] 分析PARA分布...")
 
@@ -91,8 +619,8 @@ class TrevanBoxMetricsAnalyzer:
 
         # 统计各类别文件数量
         for category in self.para_config.keys():
-            count = self._count_markdown_files(category)
-            size = self._get_directory_size(category)
+            count = scan.category_counts.get(category, 0)
+            size = round(scan.category_sizes.get(category, 0) / (1024 * 1024), 2)  # 转换为MB
 
             distribution[category] = {
                 "count": count,
@@ -112,28 +640,21 @@ class TrevanBoxMetricsAnalyzer:
 
         return distribution
 
-    def _analyze_pending_items(self) -> Dict[str, int]:
+    def _analyze_pending_items(self, scan: VaultScan) -> Dict[str, int]:
         """分析待处理项目"""
         print("[TrevanBox] 分析待处理项目...")
 
-        pending_dir = self.base_path / "0-Inbox" / "pending"
-        if not pending_dir.exists():
-            return {"count": 0, "oldest_age": 0}
-
-        pending_files = list(pending_dir.glob("**/*.md"))
-        count = len(pending_files)
-
+        count = scan.pending_count
         if count == 0:
             return {"count": 0, "oldest_age": 0}
 
         # 计算最旧文件年龄
         current_time = datetime.datetime.now().timestamp()
-        oldest_timestamp = min(f.stat().st_mtime for f in pending_files)
-        oldest_age = int((current_time - oldest_timestamp) / 86400)  # 转换为天
+        oldest_age = int((current_time - scan.oldest_pending_mtime) / 86400)  # 转换为天
 
         return {"count": count, "oldest_age": oldest_age}
 
-    def _analyze_content_quality(self) -> Dict[str, float]:
+    def _analyze_content_quality(self, scan: VaultScan, index: Optional[FileStatIndex]) -> Dict[str, float]:
         """分析内容质量"""
         print("[TrevanBox] 分析内容质量...")
 
@@ -141,40 +662,103 @@ class TrevanBoxMetricsAnalyzer:
         files_with_metadata = 0
         files_with_links = 0
         total_links = 0
+        total_words = 0
         recently_updated = 0
 
-        # 统计所有markdown文件
-        for md_file in self.base_path.glob("**/*.md"):
-            if "0-Inbox" in str(md_file):
-                continue  # 跳过待处理文件
-
+        cached = index.load() if index else {}
+        updates = []
+        current_time = datetime.datetime.now().timestamp()
+        # 链接图谱需要仓库中的全部笔记，使用索引时0-Inbox中的文件也会被统计
+        indexed_files = scan.markdown_files + scan.inbox_files if index else scan.markdown_files
+
+        # 新增或修改过的文件才读取全文
+        facts = {}
+        for md_file, rel_path, mtime, size in indexed_files:
+            entry = cached.pop(rel_path, None)
+            if entry and entry[0] == size and entry[1] == mtime:
+                facts[rel_path] = entry[2:]
+        changed = [item for item in indexed_files if item[1] not in facts]
+        changed_facts = self._read_file_facts([md_file for md_file, _, _, _ in changed])
+        for (md_file, rel_path, mtime, size), file_facts in zip(changed, changed_facts):
+            facts[rel_path] = (file_facts.has_frontmatter, file_facts.link_count, file_facts.word_count)
+            category = rel_path.split(os.sep, 1)[0]
+            updates.append((rel_path, size, mtime, category if category in self.para_config else "", file_facts))
+
+        # 统计所有markdown文件（扫描时已跳过0-Inbox中的待处理文件）
+        for md_file, rel_path, mtime, size in scan.markdown_files:
             total_files += 1
+            has_frontmatter, link_count, word_count = facts[rel_path]
 
             # 检查是否有标准化元数据
-            content = md_file.read_text(encoding='utf-8', errors='ignore')
-            if self._has_frontmatter(content):
+            if has_frontmatter:
                 files_with_metadata += 1
 
             # 统计链接数量
-            links = re.findall(r'\[\[([^\]]+)\]\]', content)
-            if links:
+            if link_count:
                 files_with_links += 1
-                total_links += len(links)
+                total_links += link_count
+            total_words += word_count
 
             # 检查最近更新（30天内）
-            file_age_days = (datetime.datetime.now().timestamp() - md_file.stat().st_mtime) / 86400
+            file_age_days = (current_time - mtime) / 86400
             if file_age_days <= 30:
                 recently_updated += 1
 
+        if index:
+            # cached中剩下的是已删除的文件
+            index.update(updates, list(cached))
+            print(f"[TrevanBox] 文件索引: 重新读取 {len(updates)}/{len(indexed_files)} 个文件")
+
         # 计算质量指标
         return {
             "metadata_coverage": (files_with_metadata / total_files * 100) if total_files > 0 else 0,
             "linked_files_ratio": (files_with_links / total_files * 100) if total_files > 0 else 0,
             "avg_links_per_file": (total_links / total_files) if total_files > 0 else 0,
+            "avg_words_per_file": (total_words / total_files) if total_files > 0 else 0,
             "content_activity": (recently_updated / total_files * 100) if total_files > 0 else 0,
             "overall_quality": 0  # 稍后计算
         }
 
+    def _open_index(self) -> Optional[FileStatIndex]:
+        """打开文件统计索引，不可用时退回全量读取"""
+        if not self.use_index:
+            return None
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            index = FileStatIndex(str(self.index_path))
+            if self.rebuild_index:
+                index.clear()
+            return index
+        except (sqlite3.Error, OSError) as e:
+            print(f"[TrevanBox] 文件索引不可用，将读取全部文件: {e}")
+            return None
+
+    def _analyze_link_graph(self, index: Optional[FileStatIndex]) -> Dict:
+        """分析链接图谱（依赖文件统计索引）"""
+        if not index:
+            return {}
+        print("[TrevanBox] 分析链接图谱...")
+
+        graph = LinkGraph(index.conn)
+        stats = graph.stats()
+        stats["hubs"] = graph.hubs(5)
+        stats["broken_examples"] = graph.broken_links(10)
+        return stats
+
+    def _read_file_facts(self, paths: List[str]) -> List[FileFacts]:
+        """读取并统计文件，结果按输入顺序返回
+
+        jobs>1时把文件分批交给进程池或线程池，executor.map保持顺序，合并结果与串行完全一致。
+        """
+        if self.jobs <= 1 or len(paths) < 2:
+            return extract_batch_facts(paths)
+
+        batch_size = max(1, min(256, len(paths) // (self.jobs * 4)))
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        executor_class = ThreadPoolExecutor if self.pool == "thread" else ProcessPoolExecutor
+        with executor_class(max_workers=self.jobs) as executor:
+            return [file_facts for batch in executor.map(extract_batch_facts, batches) for file_facts in batch]
+
     def _analyze_efficiency(self) -> Dict[str, float]:
         """分析效率指标"""
         print("[TrevanBox] 分析效率指标...")
@@ -243,30 +827,6 @@ class TrevanBoxMetricsAnalyzer:
         else:
             return max(0.0, 100.0 - (value - max_val) * 2)
 
-    def _count_markdown_files(self, directory: str) -> int:
-        """统计指定目录中的markdown文件数量"""
-        dir_path = self.base_path / directory
-        if not dir_path.exists():
-            return 0
-        return len(list(dir_path.glob("**/*.md")))
-
-    def _get_directory_size(self, directory: str) -> float:
-        """获取目录大小（MB）"""
-        dir_path = self.base_path / directory
-        if not dir_path.exists():
-            return 0.0
-
-        total_size = 0
-        for file_path in dir_path.rglob("*"):
-            if file_path.is_file():
-                total_size += file_path.stat().st_size
-
-        return round(total_size / (1024 * 1024), 2)  # 转换为MB
-
-    def _has_frontmatter(self, content: str) -> bool:
-        """检查文件是否有frontmatter"""
-        return bool(re.match(r'^---\n.*?\n---', content, re.DOTALL))
-
     def _load_history(self) -> List[Dict]:
         """加载历史数据"""
         if not self.history_file.exists():
@@ -349,9 +909,14 @@ class TrevanBoxMetricsAnalyzer:
 | 元数据覆盖率 | {metrics.content_quality['metadata_coverage']:.1f}% | >90% | {self._get_quality_emoji(metrics.content_quality['metadata_coverage'], 90)} |
 | 链接文件比例 | {metrics.content_quality['linked_files_ratio']:.1f}% | >80% | {self._get_quality_emoji(metrics.content_quality['linked_files_ratio'], 80)} |
 | 平均链接数/文件 | {metrics.content_quality['avg_links_per_file']:.1f} | >3 | {self._get_quality_emoji(metrics.content_quality['avg_links_per_file'] * 20, 60)} |
+| 平均字数/文件 | {metrics.content_quality['avg_words_per_file']:.0f} | - | - |
 | 内容活跃度 | {metrics.content_quality['content_activity']:.1f}% | >40% | {self._get_quality_emoji(metrics.content_quality['content_activity'], 40)} |
 | **总体质量** | **{metrics.content_quality['overall_quality']:.1f}/100** | **>80** | **{self._get_health_emoji(metrics.content_quality['overall_quality'])}** |
 
+## 🔗 链接图谱
+
+{self._generate_link_graph_section(metrics.link_graph)}
+
 ## ⚡ 效率指标分析
 
 | 效率指标 | 数值/100 | 状态 | 建议 |
@@ -488,6 +1053,37 @@ class TrevanBoxMetricsAnalyzer:
 
         return table
 
+    def _generate_link_graph_section(self, link_graph: Dict) -> str:
+        """生成链接图谱部分"""
+        if not link_graph:
+            return "> *未使用文件统计索引（--no-index），跳过链接图谱分析*"
+
+        lines = [
+            "| 图谱指标 | 数值 | 理想范围 | 状态 |",
+            "|----------|------|----------|------|",
+            f"| 笔记节点 | {link_graph['notes']} | - | - |",
+            f"| 笔记间连接 | {link_graph['edges']} | - | - |",
+            f"| 链接解析率 | {link_graph['resolved_ratio']:.1f}% | >95% | {self._get_quality_emoji(link_graph['resolved_ratio'], 95)} |",
+            f"| 断链 | {link_graph['broken_links']} | 0 | {'🟢' if link_graph['broken_links'] == 0 else '🔴'} |",
+            f"| 失效标题锚点 | {link_graph['broken_anchors']} | 0 | {'🟢' if link_graph['broken_anchors'] == 0 else '🟡'} |",
+            f"| 孤立笔记 | {link_graph['orphan_notes']}（{link_graph['orphan_ratio']:.1f}%） | <20% | "
+            f"{self._get_quality_emoji(100 - link_graph['orphan_ratio'], 80)} |",
+            "",
+            "### 核心枢纽笔记",
+        ]
+        hubs = link_graph.get("hubs") or []
+        lines.extend(f"{i}. {path}（{count}篇笔记链接到这里）" for i, (path, count) in enumerate(hubs, 1))
+        if not hubs:
+            lines.append("- 暂无笔记间链接")
+
+        broken = link_graph.get("broken_examples") or []
+        if broken:
+            lines.extend(["", "### 断链示例", ""])
+            lines.extend(f"- {path} → `[[{raw}]]`" for path, raw in broken)
+            lines.append("")
+            lines.append("> 运行 `metrics_analyzer.py --broken-links` 查看全部断链")
+        return "\n".join(lines)
+
     def _generate_health_analysis(self, para_stats: Dict) -> str:
         """生成健康度分析"""
         analysis = []
@@ -541,6 +1137,12 @@ class TrevanBoxMetricsAnalyzer:
         if metrics.content_quality['avg_links_per_file'] < 3:
             improvements.append("- 提升平均链接密度")
 
+        # 链接图谱
+        if metrics.link_graph.get('broken_links'):
+            improvements.append(f"- 修复{metrics.link_graph['broken_links']}个断链")
+        if metrics.link_graph.get('orphan_ratio', 0) > 20:
+            improvements.append(f"- 为{metrics.link_graph['orphan_notes']}篇孤立笔记建立链接")
+
         return "\n".join(improvements) if improvements else "- 各项指标良好，继续精细化使用"
 
     def _generate_long_term_optimizations(self, metrics: SystemMetrics) -> str:
@@ -554,6 +1156,31 @@ class TrevanBoxMetricsAnalyzer:
 
         return "\n".join(optimizations)
 
+    def query_link_graph(self, backlinks: Optional[str] = None, orphans: bool = False,
+                         broken_links: bool = False, hubs: Optional[int] = None) -> int:
+        """查询上次分析时建立的链接图谱，返回退出码"""
+        if not self.index_path.exists():
+            print("[ERROR] 尚未建立文件统计索引，请先运行一次完整分析")
+            return 1
+
+        started = time.perf_counter()
+        index = FileStatIndex(str(self.index_path))
+        try:
+            graph = LinkGraph(index.conn)
+            if backlinks:
+                _print_paths(f"链接到 {backlinks} 的笔记", graph.backlinks(backlinks))
+            if orphans:
+                _print_paths("孤立笔记", graph.orphans())
+            if broken_links:
+                broken = graph.broken_links()
+                _print_paths("断链", [f"{path} → [[{raw}]]" for path, raw in broken])
+            if hubs:
+                _print_paths("枢纽笔记", [f"{path}（{count}）" for path, count in graph.hubs(hubs)])
+        finally:
+            index.close()
+        print(f"\n[TrevanBox] 查询耗时 {(time.perf_counter() - started) * 1000:.1f} ms（基于上次分析时的索引）")
+        return 0
+
     def run_analysis(self, save_history: bool = True, generate_report: bool = True) -> str:
         """运行完整分析流程"""
         print("[TrevanBox] 开始系统度量分析...")
@@ -581,9 +1208,17 @@ class TrevanBoxMetricsAnalyzer:
         print(f"待处理积压: {metrics.pending_items} 项 (最旧: {metrics.oldest_pending_age} 天)")
         print(f"内容质量: {metrics.content_quality['overall_quality']:.1f}/100")
         print(f"使用效率: {metrics.efficiency_metrics['overall_efficiency']:.1f}/100")
+        if metrics.link_graph:
+            print(f"链接图谱: {metrics.link_graph['notes']} 篇笔记，断链 {metrics.link_graph['broken_links']} 个，"
+                  f"孤立笔记 {metrics.link_graph['orphan_notes']} 篇")
 
         return report_path
 
+def _print_paths(title: str, paths: List[str]):
+    print(f"{title}（{len(paths)}）:")
+    for path in paths:
+        print(f"  {path}")
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="TrevanBox 高级度量分析工具")
@@ -591,11 +1226,24 @@ def main():
     parser.add_argument("--no-save", action="store_true", help="不保存历史数据")
     parser.add_argument("--no-report", action="store_true", help="不生成详细报告")
     parser.add_argument("--quiet", action="store_true", help="静默模式，只输出结果")
+    parser.add_argument("--no-index", action="store_true", help="不使用文件统计索引，重新读取全部文件")
+    parser.add_argument("--rebuild-index", action="store_true", help="清空并重建文件统计索引")
+    parser.add_argument("--jobs", type=int, default=1, help="并行读取文件的工作数（默认1为串行）")
+    parser.add_argument("--pool", choices=["process", "thread"], default="process",
+                        help="并行方式：process适合本地磁盘，thread适合网络挂载")
+    # 链接图谱查询（读取上次分析时建立的索引，不重新扫描）
+    parser.add_argument("--backlinks", metavar="NOTE", help="列出链接到指定笔记（路径或文件名）的笔记")
+    parser.add_argument("--orphans", action="store_true", help="列出孤立笔记")
+    parser.add_argument("--broken-links", action="store_true", help="列出断链和失效的标题锚点")
+    parser.add_argument("--hubs", type=int, metavar="N", help="列出反向链接最多的N篇笔记")
 
     args = parser.parse_args()
 
     try:
-        analyzer = TrevanBoxMetricsAnalyzer(args.base_path)
+        analyzer = TrevanBoxMetricsAnalyzer(args.base_path, use_index=not args.no_index,
+                                            rebuild_index=args.rebuild_index, jobs=args.jobs, pool=args.pool)
+        if args.backlinks or args.orphans or args.broken_links or args.hubs:
+            return analyzer.query_link_graph(args.backlinks, args.orphans, args.broken_links, args.hubs)
         report_path = analyzer.run_analysis(
             save_history=not args.no_save,
             generate_report=not args.no_report
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TrevanBox AI预处理器性能基准
+离线运行，无需真实的Ollama服务
+
+功能：
+- 本地模拟Ollama服务（/api/generate、/api/tags），可配置延迟分布
+- 模拟格式错误的响应、5xx错误、超时和主机饱和（并发超过容量后延迟急剧上升）
+- 生成不同规模、不同编码（UTF-8/GB18030）的合成导入目录
+- 统计process_directory的吞吐量（文件/秒）、单文件延迟p50/p95和峰值内存
+- 与基线结果比较，性能回退超过阈值时返回非零退出码
+- 测量`prehandler.py status`的启动耗时，超过预算或导入了重依赖时返回非零退出码
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# 模拟的结构化响应
+CANNED_RESPONSES = [
+    "标题：[本地知识管理实践]\n标签：[知识管理, para, 笔记, 效率]\n描述：[介绍基于PARA方法的本地知识管理流程，包括收集、整理和回顾三个环节。]\n",
+    "<think>\n先概括主题，再提取标签。\n</think>\n标题：[阅读笔记整理方法]\n标签：[阅读, 笔记, 方法]\n描述：[总结阅读笔记的整理方法，强调摘录、批注与复盘的结合。]\n",
+    "标题：学术文献速读\n标签：文献, 研究, zotero\n描述：说明如何快速浏览学术文献并记录核心结论与引用信息。\n",
+]
+
+# 格式错误的响应：缺少结构化字段
+MALFORMED_RESPONSES = [
+    "抱歉，我无法处理这段内容。",
+    "这篇文章主要讲了知识管理。",
+]
+
+SAMPLE_PARAGRAPHS = [
+    "知识管理的核心在于让信息在需要的时候能够被找到并被使用。",
+    "PARA方法把所有资料分为项目、领域、资源和归档四类，按可执行性组织。",
+    "每周回顾可以帮助我们清理收集箱，并把零散的想法转化为可执行的任务。",
+    "Readwise highlights are synced into the vault and reviewed weekly.",
+    "学术文献的阅读笔记需要记录研究问题、方法、结论以及与已有工作的关系。",
+]
+
+
+class LatencyModel:
+    """模拟服务端延迟分布
+
+    格式：fixed:秒、uniform:最小,最大、lognormal:中位数,sigma
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',') if p]
+        if kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return random.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return random.lognormvariate(math.log(median), sigma)
+
+
+class MockOllamaServer:
+    """本地模拟的Ollama服务"""
+
+    def __init__(self, latency: str = "fixed:0.05", malformed_ratio: float = 0.0,
+                 error_ratio: float = 0.0, timeout_ratio: float = 0.0, hang_seconds: float = 10.0,
+                 capacity: Optional[int] = None, port: int = 0):
+        self.latency = LatencyModel(latency)
+        self.malformed_ratio = malformed_ratio
+        self.error_ratio = error_ratio
+        self.timeout_ratio = timeout_ratio
+        self.hang_seconds = hang_seconds
+        self.capacity = capacity
+        self.requests = 0
+        self.inflight = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self) -> 'MockOllamaServer':
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data: Dict, status: int = 200):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "qwen3:8b"}]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.inflight += 1
+                try:
+                    self._generate(payload)
+                finally:
+                    with server._lock:
+                        server.inflight -= 1
+
+            def _generate(self, payload: Dict):
+                roll = random.random()
+                if roll < server.timeout_ratio:
+                    time.sleep(server.hang_seconds)
+                    self.close_connection = True
+                    return
+                time.sleep(server.latency.sample() * server.overload_factor())
+                if roll < server.timeout_ratio + server.error_ratio:
+                    self._send_json({"error": "model overloaded"}, 503)
+                    return
+
+                malformed = roll < server.timeout_ratio + server.error_ratio + server.malformed_ratio
+                text = server.render_response(payload, malformed)
+                stats = {"prompt_eval_count": len(payload.get("prompt", "")) // 2,
+                         "eval_count": len(text) // 2, "eval_duration": 10 ** 8}
+
+                if payload.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+                    self.close_connection = True
+                    try:
+                        for i in range(0, len(text), 8):
+                            chunk = {"response": text[i:i + 8], "done": False}
+                            self.wfile.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode('utf-8'))
+                        self.wfile.write((json.dumps({"response": "", "done": True, **stats}) + "\n").encode('utf-8'))
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # 客户端提前结束读取
+                    return
+
+                self._send_json({"response": text, "done": True, **stats})
+
+        return Handler
+
+    def overload_factor(self) -> float:
+        """模拟主机饱和：并发请求超过capacity后延迟按超出比例的平方增长"""
+        if not self.capacity:
+            return 1.0
+        with self._lock:
+            return max(1.0, self.inflight / self.capacity) ** 2
+
+    @staticmethod
+    def render_response(payload: Dict, malformed: bool) -> str:
+        """根据请求生成模拟的模型输出"""
+        if malformed:
+            return random.choice(MALFORMED_RESPONSES)
+        if payload.get("format"):
+            # 批量请求：按笔记编号返回JSON
+            count = payload.get("prompt", "").count("【笔记")
+            notes = [{"id": i, "title": "合批笔记标题", "tags": ["合批", "测试"], "description": "合批生成的描述。"}
+                     for i in range(1, count + 1)]
+            return json.dumps({"notes": notes}, ensure_ascii=False)
+        return random.choice(CANNED_RESPONSES)
+
+
+def generate_import_dir(target: str, count: int, gb18030_ratio: float = 0.2, seed: int = 42):
+    """生成合成导入目录：长短混合、部分文件带frontmatter、部分为GB18030编码"""
+    rng = random.Random(seed)
+    os.makedirs(target, exist_ok=True)
+    for i in range(count):
+        paragraphs = rng.choice([1, 3, 10, 60])
+        body = "\n\n".join(rng.choice(SAMPLE_PARAGRAPHS) for _ in range(paragraphs))
+        if rng.random() < 0.5:
+            content = f"---\ntitle: 合成笔记{i}\nsource: benchmark\n---\n\n{body}\n"
+        else:
+            content = f"# 合成笔记{i}\n\n{body}\n"
+        encoding = 'gb18030' if rng.random() < gb18030_ratio else 'utf-8'
+        subdir = os.path.join(target, f"batch-{i // 100:03d}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"note-{i:05d}.md"), 'w', encoding=encoding) as f:
+            f.write(content)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def run_scenario(spec: Dict) -> Dict:
+    """在当前进程中运行单个场景（由子进程调用，以便单独统计峰值内存）"""
+    from prehandler import DEFAULT_CONFIG, TrevanPrehandler
+
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    config["ollama"].update({"base_url": spec["url"], "timeout": spec["timeout"],
+                             "retry": spec["retry"], "backoff_base": 0.05, "backoff_max": 0.5})
+    config["processing"]["concurrency"] = spec["workers"]
+    config["processing"]["incremental"] = False
+    config["cache"]["enabled"] = False
+    config["dedup"]["action"] = "off"
+    config["tagger"]["enabled"] = False
+    config["limiter"]["enabled"] = spec["adaptive"]
+    config["ai"]["batch_enabled"] = spec["batch"]
+    config["ollama"]["stream"] = spec["stream"]
+    config["ollama"]["warmup"] = False
+
+    prehandler = TrevanPrehandler(config)
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            started = time.perf_counter()
+            results = prehandler.process_directory(spec["directory"], dry_run=spec["dry_run"])
+            wall = time.perf_counter() - started
+        finally:
+            sys.stdout = stdout
+
+    latencies = [r["elapsed"] for r in results if "elapsed" in r]
+    return {
+        "files": len(results),
+        "failed": sum(1 for r in results if not r["success"]),
+        "wall_seconds": wall,
+        "files_per_sec": len(results) / wall if wall > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def run_in_subprocess(spec: Dict) -> Dict:
+    """在独立子进程中运行场景"""
+    script = os.path.abspath(__file__)
+    completed = subprocess.run(
+        [sys.executable, script, "_scenario", json.dumps(spec)],
+        cwd=os.path.dirname(script), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"场景运行失败:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_table(rows: List[Dict]):
+    """输出结果表格"""
+    print("| 场景 | 文件数 | 失败 | 吞吐(文件/秒) | p50(秒) | p95(秒) | 峰值内存(MB) |")
+    print("|------|--------|------|---------------|---------|---------|--------------|")
+    for row in rows:
+        print(f"| {row['name']} | {row['files']} | {row['failed']} | {row['files_per_sec']:.2f} | "
+              f"{row['p50']:.3f} | {row['p95']:.3f} | {row['peak_rss_mb']:.1f} |")
+
+
+def compare_baseline(rows: List[Dict], baseline_path: str, max_regression: float) -> List[str]:
+    """与基线比较，返回超过阈值的回退项"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {row["name"]: row for row in json.load(f)}
+
+    regressions = []
+    for row in rows:
+        base = baseline.get(row["name"])
+        if not base:
+            continue
+        if base["files_per_sec"] and row["files_per_sec"] < base["files_per_sec"] * (1 - max_regression):
+            regressions.append(f"{row['name']}: 吞吐 {base['files_per_sec']:.2f} → {row['files_per_sec']:.2f}")
+        if base["p95"] and row["p95"] > base["p95"] * (1 + max_regression):
+            regressions.append(f"{row['name']}: p95 {base['p95']:.3f}s → {row['p95']:.3f}s")
+        if base["peak_rss_mb"] and row["peak_rss_mb"] > base["peak_rss_mb"] * (1 + max_regression):
+            regressions.append(f"{row['name']}: 峰值内存 {base['peak_rss_mb']:.1f}MB → {row['peak_rss_mb']:.1f}MB")
+    return regressions
+
+
+# status命令不应导入的重依赖（只在调用模型或检测编码时才需要）
+STARTUP_FORBIDDEN_MODULES = ["requests", "urllib3", "chardet"]
+
+
+def imported_modules(stderr: str) -> List[str]:
+    """从 -X importtime 的输出中解析导入的模块名"""
+    modules = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            modules.append(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def run_startup_check(args) -> int:
+    """测量 prehandler.py status 的启动耗时（中位数），超过预算或导入了重依赖时返回1"""
+    server = MockOllamaServer().start()
+    workdir = tempfile.mkdtemp(prefix="trevanbox-startup-")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prehandler.py")
+    config_path = os.path.join(workdir, "config.yaml")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({"ollama": {"base_url": server.url}}, f)  # JSON也是合法的YAML
+    command = [sys.executable, script, "--config", config_path, "status"]
+
+    try:
+        durations = []
+        for _ in range(args.startup_runs):
+            started = time.perf_counter()
+            completed = subprocess.run(command, capture_output=True, text=True)
+            durations.append((time.perf_counter() - started) * 1000)
+            if completed.returncode != 0 or "[OK] Ollama服务正常" not in completed.stdout:
+                print(f"[ERROR] status运行失败:\n{completed.stdout}{completed.stderr}")
+                return 1
+        traced = subprocess.run([sys.executable, "-X", "importtime"] + command[1:], capture_output=True, text=True)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    median = percentile(durations, 50)
+    modules = imported_modules(traced.stderr)
+    heavy = [name for name in STARTUP_FORBIDDEN_MODULES
+             if any(module == name or module.startswith(name + ".") for module in modules)]
+    print(f"status启动耗时: 中位数 {median:.0f}ms，最快 {min(durations):.0f}ms（{args.startup_runs}次），"
+          f"预算 {args.startup_budget_ms:.0f}ms")
+    print(f"导入的重依赖: {', '.join(heavy) if heavy else '无'}")
+
+    failed = False
+    if median > args.startup_budget_ms:
+        print("[ERROR] 启动耗时超过预算")
+        failed = True
+    if heavy:
+        print(f"[ERROR] status不应导入: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("[OK] 启动耗时在预算内")
+    return 1 if failed else 0
+
+
+def run_benchmark(args) -> int:
+    """生成数据集、启动模拟服务并依次运行所有场景"""
+    server = MockOllamaServer(args.latency, args.malformed_ratio, args.error_ratio,
+                              args.timeout_ratio, args.hang_seconds, args.capacity).start()
+    workdir = tempfile.mkdtemp(prefix="trevanbox-bench-")
+    rows = []
+    print(f"模拟Ollama服务: {server.url}（延迟 {args.latency}）")
+
+    try:
+        for size in args.sizes:
+            source = os.path.join(workdir, f"source-{size}")
+            generate_import_dir(source, size, args.gb18030_ratio)
+            for workers in args.workers:
+                # 每个场景使用数据集的新副本，避免上一轮写入影响结果
+                directory = os.path.join(workdir, f"run-{size}-{workers}")
+                shutil.copytree(source, directory)
+                spec = {
+                    "url": server.url, "directory": directory, "workers": workers,
+                    "timeout": args.client_timeout, "retry": args.retry, "batch": not args.no_batch,
+                    "stream": not args.no_stream, "dry_run": args.dry_run, "adaptive": args.adaptive,
+                }
+                name = f"{size}files-{'adaptive' if args.adaptive else 'w'}{workers}"
+                print(f"运行场景: {name}")
+                row = run_in_subprocess(spec)
+                row["name"] = name
+                rows.append(row)
+                shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print_table(rows)
+    print(f"\n模拟服务共收到 {server.requests} 个生成请求")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}")
+
+    if args.baseline:
+        regressions = compare_baseline(rows, args.baseline, args.max_regression)
+        if regressions:
+            print(f"\n[ERROR] 相对基线的性能回退超过 {args.max_regression:.0%}:")
+            for item in regressions:
+                print(f"  {item}")
+            return 1
+        print(f"\n[OK] 未发现超过 {args.max_regression:.0%} 的性能回退")
+    return 0
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+def main() -> int:
+    if len(sys.argv) == 3 and sys.argv[1] == "_scenario":
+        print(json.dumps(run_scenario(json.loads(sys.argv[2]))))
+        return 0
+
+    parser = argparse.ArgumentParser(description="TrevanBox AI预处理器性能基准（离线）")
+    parser.add_argument('--sizes', type=parse_int_list, default=[50, 200], help='导入目录的文件数，逗号分隔')
+    parser.add_argument('--workers', type=parse_int_list, default=[1, 4], help='推理并发数，逗号分隔')
+    parser.add_argument('--latency', default='lognormal:0.05,0.5',
+                        help='模拟延迟分布：fixed:秒 | uniform:最小,最大 | lognormal:中位数,sigma')
+    parser.add_argument('--malformed-ratio', type=float, default=0.05, help='格式错误响应的比例')
+    parser.add_argument('--error-ratio', type=float, default=0.0, help='5xx错误响应的比例')
+    parser.add_argument('--timeout-ratio', type=float, default=0.0, help='超时（挂起）请求的比例')
+    parser.add_argument('--hang-seconds', type=float, default=5.0, help='超时请求的挂起时间（秒）')
+    parser.add_argument('--client-timeout', type=float, default=2.0, help='预处理器的请求超时（秒）')
+    parser.add_argument('--retry', type=int, default=1, help='预处理器的重试次数')
+    parser.add_argument('--gb18030-ratio', type=float, default=0.2, help='GB18030编码文件的比例')
+    parser.add_argument('--no-batch', action='store_true', help='关闭短笔记合批')
+    parser.add_argument('--no-stream', action='store_true', help='关闭流式接收')
+    parser.add_argument('--dry-run', action='store_true', help='预览模式，不写入文件')
+    parser.add_argument('--capacity', type=int, help='模拟服务的并发容量，超过后延迟急剧上升')
+    parser.add_argument('--adaptive', action='store_true', help='启用自适应并发，--workers作为并发上限')
+    parser.add_argument('--output', help='将结果保存为JSON（可作为基线）')
+    parser.add_argument('--baseline', help='基线结果JSON文件')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='允许的最大回退比例')
+    parser.add_argument('--startup', action='store_true', help='只测量status命令的启动耗时')
+    parser.add_argument('--startup-budget-ms', type=float, default=500, help='status启动耗时预算（毫秒，按中位数）')
+    parser.add_argument('--startup-runs', type=int, default=5, help='启动耗时的测量次数')
+    args = parser.parse_args()
+
+    if args.startup:
+        return run_startup_check(args)
+    return run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,14 +23,23 @@ TrevanBox AI预处理器
 import os
 import sys
 import json
-import yaml
-import requests
 import argparse
-import chardet
 import datetime
 import re
+import fnmatch
+import time
+import random
+import hashlib
+import math
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+# requests、yaml、chardet、sqlite3等依赖在用到时才导入：
+# status等轻量命令无需加载它们，从Obsidian钩子或cron频繁调用时启动更快
+if TYPE_CHECKING:
+    import requests
 
 # 默认配置
 DEFAULT_CONFIG = {
@@ -38,7 +47,19 @@ DEFAULT_CONFIG = {
         "base_url": "http://localhost:11434",
         "model": "qwen3:8b",
         "timeout": 30,
-        "retry": 3
+        "retry": 3,  # 超时、连接错误和5xx响应的重试次数
+        "backoff_base": 1.0,  # 指数退避的初始等待（秒）
+        "backoff_max": 30.0,  # 单次退避的最长等待（秒）
+        "pool_size": None,  # HTTP连接池大小，默认与并发数一致
+        "file_deadline": 300,  # 单个文件所有模型调用的总时限（秒）
+        "stream": True,  # 流式接收，结构化字段齐全后提前结束生成
+        "think": False,  # 关闭qwen3等模型的思考输出，None不发送该参数
+        # 多个Ollama节点：[{"url": ..., "weight": 1, "max_inflight": 2}]，为空时只使用base_url
+        "endpoints": [],
+        "eject_after_failures": 2,  # 连续失败多少次后暂时剔除节点
+        "probe_interval": 30,  # 被剔除节点的重新探测间隔（秒）
+        "keep_alive": "30m",  # 模型在空闲后保持加载的时长，None使用服务端默认值
+        "warmup": True  # 发现需要处理的文件后在后台预先加载模型
     },
     "metadata": {
         "default_status": "sprout",
@@ -46,18 +67,118 @@ DEFAULT_CONFIG = {
         "standard_fields": ["created", "updated", "status", "type", "tags", "area", "title", "description"]
     },
     "processing": {
-        "max_file_size": 10 * 1024 * 1024,  # 10MB
+        "max_file_size": 10 * 1024 * 1024,  # 10MB，超过的文件不读取
         "encoding_detection": True,
+        "encoding_sample_size": 64 * 1024,  # 非UTF-8文件用于chardet检测的样本大小
         "backup_enabled": True,
-        "move_to_inbox": False  # 处理完成后是否移动到待处理目录
+        "move_to_inbox": False,  # 处理完成后是否移动到待处理目录
+        "concurrency": 1,  # 推理阶段的并发请求数（1为顺序请求模型）
+        "parse_workers": 2,  # 读取/解码/解析frontmatter阶段的线程数
+        "commit_workers": 1,  # 写入/移动文件阶段的线程数
+        "queue_size": 32,  # 阶段间队列容量；流水线中和等待按序输出的文件合计不超过其3倍
+        "incremental": True,  # 跳过清单中记录为未变化的文件
+        "queue_order": "path"  # 处理顺序：path、smallest、largest、newest、oldest
     },
     "ai": {
         "title_max_length": 15,
         "tags_max_count": 7,
-        "summary_length": 200
+        "summary_length": 200,
+        "num_predict": None,  # 输出token上限，默认根据标题/标签/摘要长度推算
+        "thinking_tokens": 2048,  # 未关闭思考（ollama.think不为False）时为思考文本额外预留的输出token
+        "batch_enabled": True,  # 短笔记合并为一次JSON结构化请求
+        "batch_max_note_chars": 800,  # 不超过该长度的笔记参与合批
+        "batch_char_budget": 4000,  # 单批内容总字符数上限
+        "batch_max_notes": 8,  # 单批最多笔记数
+        "long_doc_enabled": True,  # 长文档先分段摘要再汇总（map-reduce）
+        "long_doc_threshold": 6000,  # 超过该字符数的笔记走长文档模式
+        "chunk_size": 3000,  # 每个分段的最大字符数
+        "chunk_summary_length": 150,  # 分段摘要字数
+        "chunk_workers": 2,  # 单篇长文档同时摘要的分段数
+        "chunk_deadline": 60  # 长文档每轮分段摘要在file_deadline之外增加的时限（秒）
+    },
+    "watch": {
+        "poll_interval": 5,  # 轮询模式的扫描间隔（秒）
+        "settle_seconds": 5,  # 文件大小和修改时间保持不变多久后才处理（秒）
+        "use_inotify": True  # 安装了watchdog时使用inotify等系统事件，否则轮询
+    },
+    "instrumentation": {
+        "enabled": True,  # 记录逐文件的阶段耗时和token统计
+        "log_dir": None,  # JSONL日志目录，默认为 <vault>/.trevanbox/logs
+        "retention_days": 14  # 每天一个日志文件，超过该天数的日志自动删除
+    },
+    "cache": {
+        "enabled": True,
+        "path": None,  # 默认为 <vault>/.trevanbox/ai_cache.db
+        "max_entries": 20000,
+        "max_age_days": 90
+    },
+    "tagger": {
+        "enabled": True,  # 使用本地标签分类器（需先运行 tagger train）
+        "path": None,  # 默认为 <vault>/.trevanbox/tagger.json
+        "min_docs": 3,  # 标签至少出现在这么多篇笔记中才参与训练
+        "max_features": 300,  # 每个标签保留的特征数
+        "min_score": 0.2,  # 候选标签的最低相似度
+        "min_tags": 2  # 至少有这么多个候选标签时才跳过模型生成标签
+    },
+    "limiter": {
+        "enabled": True,  # 根据延迟和错误率自动调整模型请求并发数（AIMD）
+        "min_concurrency": 1,
+        "max_concurrency": None,  # 默认为processing.concurrency
+        "initial_concurrency": None,  # 默认从min_concurrency开始逐步提升
+        "latency_tolerance": 2.0,  # 单token耗时超过基线的倍数时降低并发
+        "decrease_factor": 0.5,  # 降低时并发上限乘以该系数
+        "tokens_per_minute": None  # 每分钟token预算（提示词+输出），None为不限制
+    },
+    "dedup": {
+        "action": "reuse",  # 发现重复笔记时：reuse复用已有AI结果，skip跳过不处理，off关闭
+        "max_distance": 3,  # SimHash汉明距离不超过该值视为近似重复
+        "min_chars": 200,  # 归一化后的正文短于该长度时不检测重复（空正文不视为重复）
+        "shingle_size": 4  # SimHash使用的字符n-gram长度
     }
 }
 
+# 流水线阶段结束标记
+_SENTINEL = object()
+
+# 预处理器版本，变化后清单中的记录失效，文件会被重新处理
+PREHANDLER_VERSION = "1.1.0"
+
+# 预处理器状态目录（缓存等），位于仓库根目录下
+STATE_DIR_NAME = ".trevanbox"
+
+# 结构化提示词的字段格式和要求，按字段组合生成提示词
+FIELD_FORMATS = {
+    "标题": "[8-15字中文标题]",
+    "标签": "[3-7个中文标签，每个标签不超过4个字，用逗号分隔]",
+    "描述": "[100-200字中文总结，突出核心观点]",
+}
+FIELD_RULES = {
+    "标题": ["标题简洁准确，反映内容主题"],
+    "标签": ["标签要相关且具体，每个标签不超过4个字", "英文标签全部小写，避免重复"],
+    "描述": ["描述要结构化，包含核心观点和关键信息"],
+}
+# 合批请求JSON中各字段的示例和要求，按批内笔记所需字段生成系统提示词（笔记内容放在用户提示词中）
+BATCH_FIELD_SCHEMA = {
+    "标题": '"title": "8-15字中文标题"',
+    "标签": '"tags": ["标签1", "标签2"]',
+    "描述": '"description": "100-200字中文总结"',
+}
+BATCH_FIELD_RULES = {
+    "标题": "标题简洁准确，反映内容主题",
+    "标签": "3-7个标签，要相关且具体，每个标签不超过4个字，英文标签全部小写",
+    "描述": "描述要结构化，包含核心观点和关键信息",
+}
+# 结构化字段对应的解析结果键
+FIELD_KEYS = {"标题": "title", "标签": "tags", "描述": "description"}
+# 字段组合对应的缓存类型
+PROMPT_VARIANTS = {
+    ("标题", "标签", "描述"): "full",
+    ("标签", "描述"): "tags_description",
+    ("标题", "描述"): "title_description",
+    ("描述",): "description",
+    ("标签",): "tags",
+}
+
 # 目录映射配置
 DIRECTORY_MAPPING = {
     "follow": {"tag": "follow", "type": "article"},
@@ -70,93 +191,1306 @@ DIRECTORY_MAPPING = {
 }
 
 
+def get_vault_root() -> str:
+    """获取TrevanBox仓库根目录"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.dirname(os.path.dirname(script_dir))
+
+
+def get_state_path(filename: str, create: bool = True) -> str:
+    """获取状态目录下的文件路径；create为False时不创建状态目录（只读检查用）"""
+    state_dir = os.path.join(get_vault_root(), STATE_DIR_NAME)
+    if create:
+        os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, filename)
+
+
+@contextmanager
+def timed(stats: Optional[Dict], stage: str):
+    """把代码块的耗时累加到 stats["timings"][stage]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            timings = stats.setdefault("timings", {})
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def add_stat(stats: Optional[Dict], key: str, value):
+    """累加数值统计项"""
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + value
+
+
+def merge_stats(target: Optional[Dict], source: Optional[Dict]):
+    """把source中的耗时和数值统计累加到target"""
+    if target is None or not source:
+        return
+    for stage, seconds in source.get("timings", {}).items():
+        timings = target.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    for key, value in source.items():
+        if key != "timings" and isinstance(value, (int, float)) and not isinstance(value, bool):
+            add_stat(target, key, value)
+
+
+def split_into_chunks(content: str, chunk_size: int) -> List[str]:
+    """按markdown标题和段落边界把文本切分为不超过chunk_size的分段
+
+    先按标题切分章节，过长的章节再按空行分段，单个过长段落按长度硬切；
+    相邻小块在不超过chunk_size时合并。
+    """
+    sections = re.split(r'\n(?=#{1,6}\s)', content)
+    pieces = []
+    for section in sections:
+        if len(section) <= chunk_size:
+            pieces.append(section)
+            continue
+        for paragraph in re.split(r'\n\s*\n', section):
+            for start in range(0, len(paragraph), chunk_size):
+                pieces.append(paragraph[start:start + chunk_size])
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+        if current and len(current) + len(piece) + 2 > chunk_size:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RunStats:
+    """汇总一次运行的逐文件计时和token记录，并追加到JSONL日志
+
+    日志文件在写入第一条记录时才打开，没有处理任何文件的运行不会产生日志。
+    """
+
+    STAGES = [
+        ("read", "读取文件"),
+        ("decode", "编码检测/解码"),
+        ("frontmatter", "YAML解析"),
+        ("cache", "缓存查询"),
+        ("tagger", "本地标签"),
+        ("llm", "模型调用"),
+        ("write", "写入文件"),
+        ("move", "移动文件"),
+        ("manifest", "更新清单"),
+    ]
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.log_path = log_path
+        self._log: Optional[TextIO] = None
+        self.files = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.eval_seconds = 0.0
+        self.unmetered_calls = 0
+        self.stage_totals: Dict[str, float] = {}
+
+    def add(self, result: Dict):
+        """记录单个文件的处理结果
+
+        所有模型调用都提前结束（没有服务端统计）时，token数和生成速度记为null而不是0。
+        """
+        stats = result.get("stats") or {}
+        eval_seconds = stats.get("eval_seconds", 0.0)
+        output_tokens = stats.get("output_tokens", 0)
+        unmetered_calls = stats.get("unmetered_calls", 0)
+        metered = unmetered_calls < stats.get("llm_calls", 0) or not unmetered_calls
+        record = {
+            "time": datetime.datetime.now().isoformat(),
+            "file": result["file"],
+            "success": result["success"],
+            "error": result["error"],
+            "elapsed": round(result.get("elapsed", 0.0), 4),
+            "timings": {stage: round(seconds, 4) for stage, seconds in stats.get("timings", {}).items()},
+            "prompt_tokens": round(stats.get("prompt_tokens", 0), 1) if metered else None,
+            "output_tokens": round(output_tokens, 1) if metered else None,
+            "tokens_per_sec": round(output_tokens / eval_seconds, 1) if eval_seconds > 0 else None,
+            "unmetered_calls": unmetered_calls,
+            "cache_hit": stats.get("cache_hit", False),
+            "retries": round(stats.get("retries", 0), 2),
+            "batch_size": stats.get("batch_size", 1),
+            "chunks": stats.get("chunks", 0),
+        }
+        if self.log_path:
+            if self._log is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log.flush()
+
+        self.files += 1
+        self.failed += 0 if result["success"] else 1
+        self.cache_hits += 1 if record["cache_hit"] else 0
+        self.retries += record["retries"]
+        self.prompt_tokens += stats.get("prompt_tokens", 0)
+        self.output_tokens += output_tokens
+        self.eval_seconds += eval_seconds
+        self.unmetered_calls += unmetered_calls
+        for stage, seconds in stats.get("timings", {}).items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+
+    def print_summary(self):
+        """输出阶段耗时汇总表"""
+        if not self.files:
+            return
+        total = sum(self.stage_totals.values()) or 1.0
+        print("\n| 阶段 | 累计耗时(秒) | 平均(毫秒/文件) | 占比 |")
+        print("|------|--------------|-----------------|------|")
+        for stage, label in self.STAGES:
+            seconds = self.stage_totals.get(stage, 0.0)
+            print(f"| {label} | {seconds:.2f} | {seconds / self.files * 1000:.1f} | {seconds / total * 100:.1f}% |")
+
+        print(f"\n文件: {self.files}（失败 {self.failed}），缓存命中: {self.cache_hits}，重试: {self.retries:.0f}")
+        speed = f"{self.output_tokens / self.eval_seconds:.1f} tokens/秒" if self.eval_seconds > 0 else "-"
+        print(f"输入tokens: {self.prompt_tokens:.0f}，输出tokens: {self.output_tokens:.0f}，生成速度: {speed}")
+        if self.unmetered_calls:
+            print(f"另有 {self.unmetered_calls} 次模型调用流式提前结束，没有服务端token统计，未计入以上数字")
+        if self.log_path:
+            print(f"计时日志: {self.log_path}")
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+
+class OllamaError(Exception):
+    """Ollama调用失败（重试耗尽或超过时限）"""
+
+
+class EndpointUnavailable(OllamaError):
+    """当前没有健康的Ollama节点"""
+
+
+class InvalidResponse(OllamaError):
+    """模型响应为空，或缺少所需字段"""
+
+
+class OllamaEndpoint:
+    """单个Ollama节点及其负载状态"""
+
+    def __init__(self, url: str, weight: float = 1.0, max_inflight: Optional[int] = None):
+        self.url = url.rstrip('/')
+        self.weight = max(float(weight), 0.01)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.healthy = True
+        self.failures = 0
+        self.next_probe = 0.0
+
+    def has_capacity(self) -> bool:
+        return self.max_inflight is None or self.inflight < self.max_inflight
+
+
+class EndpointPool:
+    """Ollama节点池：按加权未完成请求数选择最空闲的节点
+
+    连续失败的节点会被剔除，之后每隔probe_interval通过/api/tags重新探测，
+    恢复后重新加入。
+    """
+
+    def __init__(self, endpoints: List[OllamaEndpoint], eject_after_failures: int = 2, probe_interval: float = 30):
+        self.endpoints = endpoints
+        self.eject_after_failures = max(1, eject_after_failures)
+        self.probe_interval = probe_interval
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, ollama_config: Dict) -> 'EndpointPool':
+        """根据ollama配置节创建节点池"""
+        endpoints = [
+            OllamaEndpoint(item["url"], item.get("weight", 1.0), item.get("max_inflight"))
+            for item in ollama_config.get("endpoints") or []
+        ] or [OllamaEndpoint(ollama_config["base_url"])]
+        return cls(endpoints, ollama_config.get("eject_after_failures", 2), ollama_config.get("probe_interval", 30))
+
+    @staticmethod
+    def probe(endpoint: OllamaEndpoint) -> bool:
+        """探测节点是否可用（使用标准库http.client，status命令无需导入requests）"""
+        import http.client
+        from urllib.parse import urlsplit
+
+        url = urlsplit(endpoint.url)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(url.hostname, url.port, timeout=5)
+        try:
+            connection.request("GET", f"{url.path.rstrip('/')}/api/tags")
+            return connection.getresponse().status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def _reprobe(self, force: bool = False):
+        """重新探测到期（或全部）被剔除的节点"""
+        now = time.monotonic()
+        with self._cond:
+            due = [e for e in self.endpoints if not e.healthy and (force or now >= e.next_probe)]
+            for endpoint in due:
+                endpoint.next_probe = now + self.probe_interval
+        for endpoint in due:
+            if self.probe(endpoint):
+                with self._cond:
+                    endpoint.healthy = True
+                    endpoint.failures = 0
+                    self._cond.notify_all()
+
+    def acquire(self, deadline: Optional[float] = None) -> OllamaEndpoint:
+        """选择节点并占用一个请求名额；所有节点满载时等待"""
+        self._reprobe()
+        with self._cond:
+            all_down = not any(e.healthy for e in self.endpoints)
+        if all_down:
+            self._reprobe(force=True)
+
+        with self._cond:
+            while True:
+                healthy = [e for e in self.endpoints if e.healthy]
+                if not healthy:
+                    raise EndpointUnavailable("没有可用的Ollama节点")
+                candidates = [e for e in healthy if e.has_capacity()]
+                if candidates:
+                    endpoint = min(candidates, key=lambda e: (e.inflight + 1) / e.weight)
+                    endpoint.inflight += 1
+                    return endpoint
+
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    raise OllamaError("等待空闲Ollama节点超过单文件处理时限")
+                self._cond.wait(timeout=min(wait, 1.0) if wait is not None else 1.0)
+
+    def release(self, endpoint: OllamaEndpoint, ok: bool):
+        """释放请求名额并记录结果"""
+        with self._cond:
+            endpoint.inflight -= 1
+            if ok:
+                endpoint.failures = 0
+            else:
+                endpoint.failures += 1
+                if endpoint.healthy and endpoint.failures >= self.eject_after_failures:
+                    endpoint.healthy = False
+                    endpoint.next_probe = time.monotonic() + self.probe_interval
+                    print(f"Ollama节点不可用，暂时剔除: {endpoint.url}")
+            self._cond.notify_all()
+
+
+class AdaptiveLimiter:
+    """模型请求的自适应并发控制（AIMD）
+
+    每个请求成功且单token耗时未明显高于基线时，并发上限加性增长（每满一轮+1）；
+    出现超时、连接错误、5xx或单token耗时超过基线的latency_tolerance倍时乘性降低。
+    单token耗时取服务端统计的eval_duration/eval_count，不含排队和提示词处理时间；
+    没有服务端统计的请求（流式提前结束）不提供耗时样本，只按成功计。
+    基线为观测到的最小单token耗时，缓慢上浮以适应模型或硬件的变化。
+    设置tokens_per_minute时另用令牌桶限制每分钟的token数（按提示词长度预估，完成后按实际值修正）。
+    """
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 4, initial: Optional[int] = None,
+                 latency_tolerance: float = 2.0, decrease_factor: float = 0.5,
+                 tokens_per_minute: Optional[int] = None):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial or self.min_limit, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.tokens_per_minute = tokens_per_minute
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self.peak = self.limit
+        self._tokens = float(tokens_per_minute or 0)
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, limiter_config: Dict, concurrency: int) -> 'AdaptiveLimiter':
+        """根据limiter配置节创建限流器，并发上限默认为processing.concurrency"""
+        return cls(limiter_config.get("min_concurrency", 1),
+                   limiter_config.get("max_concurrency") or concurrency,
+                   limiter_config.get("initial_concurrency"),
+                   limiter_config.get("latency_tolerance", 2.0),
+                   limiter_config.get("decrease_factor", 0.5),
+                   limiter_config.get("tokens_per_minute"))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.tokens_per_minute),
+                           self._tokens + (now - self._refilled) * self.tokens_per_minute / 60)
+        self._refilled = now
+
+    def acquire(self, estimated_tokens: int = 0, deadline: Optional[float] = None) -> float:
+        """占用一个并发名额（及预估的token额度）；超过上限时等待，返回请求开始时间"""
+        with self._cond:
+            while True:
+                if self.tokens_per_minute:
+                    self._refill()
+                # 单个请求超过整桶容量时等桶满即放行，避免永远等待
+                needed = min(estimated_tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+                if self.inflight < int(self.limit) and self._tokens >= needed:
+                    self.inflight += 1
+                    self._tokens -= estimated_tokens if self.tokens_per_minute else 0
+                    return time.monotonic()
+
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    raise OllamaError("等待模型并发名额超过单文件处理时限")
+                timeout = 1.0
+                if self.tokens_per_minute and self._tokens < needed:
+                    timeout = min(timeout, (needed - self._tokens) * 60 / self.tokens_per_minute)
+                self._cond.wait(timeout=min(timeout, wait) if wait is not None else timeout)
+
+    def release(self, started: float, ok: Optional[bool], per_token: Optional[float] = None,
+                estimated_tokens: int = 0, actual_tokens: int = 0):
+        """释放名额并根据结果调整并发上限
+
+        started为acquire的返回值；ok为None表示请求本身有误（如4xx），不作为负载信号。
+        per_token为服务端统计的单token生成耗时（秒），为None时不参与延迟判断。
+        """
+        with self._cond:
+            self.inflight -= 1
+            if self.tokens_per_minute and actual_tokens:
+                self._tokens -= actual_tokens - estimated_tokens
+            if ok is False:
+                self._decrease(started)
+            elif ok:
+                if per_token is not None:
+                    if self.baseline is None or per_token < self.baseline:
+                        self.baseline = per_token
+                    else:
+                        self.baseline *= 1.001
+                if per_token is not None and per_token > self.baseline * self.latency_tolerance:
+                    self._decrease(started)
+                elif self.limit < self.max_limit:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / int(self.limit))
+                    self.increases += 1
+                    self.peak = max(self.peak, self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, started: float):
+        """乘性降低；上次降低之前发出的请求不再触发降低，避免一轮拥塞连降多次"""
+        if started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        self.decreases += 1
+
+    def summary(self) -> str:
+        return (f"自适应并发: 当前 {int(self.limit)}（范围 {self.min_limit}-{self.max_limit}，峰值 {int(self.peak)}），"
+                f"提升 {self.increases} 次，降低 {self.decreases} 次")
+
+
+class SQLiteStore:
+    """线程安全的SQLite存储基类"""
+
+    SCHEMA: List[str] = []
+
+    def __init__(self, db_path: str):
+        import sqlite3
+
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+
+class AICache(SQLiteStore):
+    """AI结果缓存，按模型、提示词类型和截断内容的哈希寻址"""
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS ai_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ai_cache_accessed ON ai_cache(accessed)"
+    ]
+
+    def __init__(self, db_path: str, max_entries: int = 20000, max_age_days: int = 90):
+        super().__init__(db_path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._writes = 0
+        self.evict()
+
+    @classmethod
+    def from_config(cls, cache_config: Dict) -> 'AICache':
+        """根据cache配置节创建缓存"""
+        return cls(
+            cache_config.get("path") or get_state_path("ai_cache.db"),
+            cache_config.get("max_entries", 20000),
+            cache_config.get("max_age_days", 90)
+        )
+
+    @staticmethod
+    def make_key(model: str, variant: str, content: str) -> str:
+        """计算缓存键"""
+        digest = hashlib.sha256()
+        for part in (model, variant, content):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存，过期条目视为未命中"""
+        with self._lock:
+            row = self.conn.execute("SELECT value, created FROM ai_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.max_age_days and now - row[1] > self.max_age_days * 86400:
+                self.conn.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE ai_cache SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, model: str, variant: str, value: Dict):
+        """写入缓存"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, model, variant, value, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, variant, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self.conn.commit()
+            self._writes += 1
+            should_evict = self._writes % 500 == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """按年龄和条目数淘汰缓存，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self.conn.execute("DELETE FROM ai_cache WHERE created < ?", (cutoff,)).rowcount
+            if self.max_entries:
+                removed += self.conn.execute(
+                    """DELETE FROM ai_cache WHERE key IN (
+                        SELECT key FROM ai_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_entries,)
+                ).rowcount
+            self.conn.commit()
+        return removed
+
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        with self._lock:
+            removed = self.conn.execute("DELETE FROM ai_cache").rowcount
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+        return removed
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        with self._lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+        size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        return {"entries": count, "size_bytes": size, "path": self.db_path}
+
+
+class ProcessingManifest(SQLiteStore):
+    """增量处理清单，记录每个已处理文件的大小、修改时间、内容哈希和预处理器版本"""
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS manifest (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            version TEXT NOT NULL,
+            processed_at TEXT NOT NULL
+        )"""
+    ]
+
+    @staticmethod
+    def make_key(file_path: str) -> str:
+        """清单键：仓库内文件使用相对路径，便于多设备同步"""
+        abs_path = os.path.abspath(file_path)
+        vault_root = get_vault_root()
+        if abs_path.startswith(vault_root + os.sep):
+            return os.path.relpath(abs_path, vault_root)
+        return abs_path
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """计算文件内容哈希"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_unchanged(self, file_path: str, stat: os.stat_result) -> bool:
+        """判断文件自上次处理后是否未变化
+
+        大小和修改时间一致时无需读取文件；仅修改时间变化时比较内容哈希。
+        """
+        key = self.make_key(file_path)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256, version FROM manifest WHERE path = ?", (key,)
+            ).fetchone()
+        if row is None or row[3] != PREHANDLER_VERSION or row[0] != stat.st_size:
+            return False
+        if row[1] == stat.st_mtime_ns:
+            return True
+
+        if self.hash_file(file_path) != row[2]:
+            return False
+        with self._lock:
+            self.conn.execute("UPDATE manifest SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, key))
+            self.conn.commit()
+        return True
+
+    def record(self, file_path: str):
+        """记录文件处理后的状态"""
+        stat = os.stat(file_path)
+        sha256 = self.hash_file(file_path)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO manifest (path, size, mtime_ns, sha256, version, processed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(file_path), stat.st_size, stat.st_mtime_ns, sha256,
+                 PREHANDLER_VERSION, datetime.datetime.now().isoformat())
+            )
+            self.conn.commit()
+
+    def remove(self, file_path: str):
+        """移除文件记录（如文件已移动到待处理目录）"""
+        with self._lock:
+            self.conn.execute("DELETE FROM manifest WHERE path = ?", (self.make_key(file_path),))
+            self.conn.commit()
+
+
+class JobQueue(SQLiteStore):
+    """持久化任务队列，记录每个文件的处理状态（pending/in_progress/done/failed）和尝试次数
+
+    每次状态变化立即提交，进程中断后可用 process --resume 从中断处继续。
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+            path TEXT PRIMARY KEY,
+            directory TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS jobs_directory_state ON jobs (directory, state)"
+    ]
+
+    STATES = ["pending", "in_progress", "done", "failed"]
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.datetime.now().isoformat()
+
+    def reset(self, directory: str):
+        """清空目录的任务记录（开始新一轮处理）"""
+        with self._lock:
+            self.conn.execute("DELETE FROM jobs WHERE directory = ?", (os.path.abspath(directory),))
+            self.conn.commit()
+
+    def enqueue(self, directory: str, files: List[Path]):
+        """把文件加入队列（已有记录重置为pending，保留尝试次数）"""
+        now = self._now()
+        rows = [(os.path.abspath(f), os.path.abspath(directory), now) for f in files]
+        with self._lock:
+            self.conn.executemany(
+                """INSERT INTO jobs (path, directory, state, updated) VALUES (?, ?, 'pending', ?)
+                   ON CONFLICT(path) DO UPDATE SET state = 'pending', directory = excluded.directory,
+                   error = NULL, updated = excluded.updated""",
+                rows
+            )
+            self.conn.commit()
+
+    def start(self, file_path: str):
+        """标记文件开始处理"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'in_progress', attempts = attempts + 1, updated = ? WHERE path = ?",
+                (self._now(), os.path.abspath(file_path))
+            )
+            self.conn.commit()
+
+    def finish(self, file_path: str, error: Optional[str] = None):
+        """标记文件处理完成或失败"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE path = ?",
+                ("failed" if error else "done", error, self._now(), os.path.abspath(file_path))
+            )
+            self.conn.commit()
+
+    def files(self, directory: str, states: List[str]) -> List[Path]:
+        """返回目录中处于指定状态的文件，已不存在的文件从队列中移除"""
+        placeholders = ", ".join("?" for _ in states)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT path FROM jobs WHERE directory = ? AND state IN ({placeholders}) ORDER BY path",
+                (os.path.abspath(directory), *states)
+            ).fetchall()
+        existing = [Path(row[0]) for row in rows if os.path.exists(row[0])]
+        missing = [(row[0],) for row in rows if not os.path.exists(row[0])]
+        if missing:
+            with self._lock:
+                self.conn.executemany("DELETE FROM jobs WHERE path = ?", missing)
+                self.conn.commit()
+        return existing
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的文件数"""
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = dict.fromkeys(self.STATES, 0)
+        counts.update(rows)
+        return counts
+
+
+def normalize_text(content: str) -> str:
+    """归一化正文用于指纹计算：转小写并去掉空白、标点和markdown符号"""
+    return re.sub(r'[\W_]+', '', content.lower())
+
+
+def compute_fingerprint(text: str, shingle_size: int = 4) -> Tuple[str, int]:
+    """计算归一化正文（normalize_text的结果）的 (精确哈希, 64位SimHash)"""
+    exact = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    shingles = {text[i:i + shingle_size] for i in range(max(1, len(text) - shingle_size + 1))}
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big'), '064b')
+        for shingle in shingles
+    ]
+    simhash = 0
+    for column in zip(*bits):
+        simhash = (simhash << 1) | (column.count('1') * 2 > len(bits))
+    return exact, simhash
+
+
+class FingerprintIndex(SQLiteStore):
+    """笔记指纹索引：精确哈希 + SimHash，用于发现跨导入目录的重复笔记
+
+    SimHash按16位分为4段建索引，汉明距离不超过3的笔记至少有一段完全相同，
+    查询时只需比较段相同的候选。每条记录附带该笔记的AI结果，供重复笔记复用。
+    """
+
+    BANDS = 4
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS fingerprints (
+            path TEXT PRIMARY KEY,
+            exact TEXT NOT NULL,
+            simhash TEXT NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL,
+            near INTEGER NOT NULL,
+            result TEXT,
+            updated TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS fingerprints_exact ON fingerprints (exact)",
+    ] + [f"CREATE INDEX IF NOT EXISTS fingerprints_band{i} ON fingerprints (band{i})" for i in range(BANDS)]
+
+    def __init__(self, db_path: str, max_distance: int = 3):
+        super().__init__(db_path)
+        self.max_distance = max_distance
+
+    @classmethod
+    def bands(cls, simhash: int) -> List[int]:
+        width = 64 // cls.BANDS
+        return [(simhash >> (i * width)) & ((1 << width) - 1) for i in range(cls.BANDS)]
+
+    def find(self, file_path: str, exact: str, simhash: Optional[int]) -> Optional[Dict]:
+        """查找与文件重复的已索引笔记，返回 {"path", "result"}；simhash为None时只查完全重复
+
+        已不存在的笔记会从索引中移除；有可复用AI结果的候选优先。
+        """
+        key = ProcessingManifest.make_key(file_path)
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, simhash, result FROM fingerprints WHERE exact = ? AND path != ?", (exact, key)
+            ).fetchall()
+            if simhash is not None:
+                conditions = " OR ".join(f"band{i} = ?" for i in range(self.BANDS))
+                rows += [
+                    row for row in self.conn.execute(
+                        f"SELECT path, simhash, result FROM fingerprints WHERE near = 1 AND path != ? AND ({conditions})",
+                        (key, *self.bands(simhash))
+                    ).fetchall()
+                    if bin(int(row[1], 16) ^ simhash).count('1') <= self.max_distance
+                ]
+
+        matches = []
+        for path, _, result in rows:
+            if not os.path.exists(os.path.join(get_vault_root(), path)):
+                self.remove(path)
+                continue
+            matches.append({"path": path, "result": json.loads(result) if result else None})
+        matches.sort(key=lambda match: match["result"] is None)
+        return matches[0] if matches else None
+
+    def record(self, file_path: str, exact: str, simhash: Optional[int], result: Optional[Dict] = None):
+        """记录笔记指纹及其AI结果"""
+        near = simhash is not None
+        simhash = simhash or 0
+        with self._lock:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO fingerprints
+                   (path, exact, simhash, band0, band1, band2, band3, near, result, updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (ProcessingManifest.make_key(file_path), exact, format(simhash, '016x'), *self.bands(simhash),
+                 int(near), json.dumps(result, ensure_ascii=False) if result else None,
+                 datetime.datetime.now().isoformat())
+            )
+            self.conn.commit()
+
+    def remove(self, file_path: str):
+        """移除笔记指纹"""
+        with self._lock:
+            self.conn.execute("DELETE FROM fingerprints WHERE path = ?", (ProcessingManifest.make_key(file_path),))
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+
+def frontmatter_tags(metadata: Dict) -> List[str]:
+    """从frontmatter中取出字符串标签；tags只接受列表或单个字符串，其他类型视为没有标签"""
+    tags = metadata.get("tags")
+    if isinstance(tags, str):
+        tags = [tags]
+    if not isinstance(tags, list):
+        return []
+    return [tag for tag in tags if isinstance(tag, str)]
+
+
+class LocalTagger:
+    """本地标签分类器：每个标签一个TF-IDF质心，按余弦相似度给出候选标签
+
+    用仓库中已有笔记的frontmatter标签训练，特征为归一化正文的字符二元组（无需分词），
+    模型以JSON保存在.trevanbox中，预测只需毫秒级。
+    """
+
+    MAX_CHARS = 20000
+
+    def __init__(self, idf: Dict[str, float], centroids: Dict[str, Dict[str, float]], default_idf: float):
+        self.idf = idf
+        self.centroids = centroids
+        self.default_idf = default_idf
+        # 倒排索引：特征 → [(标签, 权重)]，预测时只访问正文中出现的特征
+        self._postings: Dict[str, List[Tuple[str, float]]] = {}
+        for tag, centroid in centroids.items():
+            for feature, weight in centroid.items():
+                self._postings.setdefault(feature, []).append((tag, weight))
+
+    @classmethod
+    def features(cls, content: str) -> Dict[str, int]:
+        """正文的字符二元组计数"""
+        text = normalize_text(content)[:cls.MAX_CHARS]
+        counts: Dict[str, int] = {}
+        for i in range(len(text) - 1):
+            gram = text[i:i + 2]
+            counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    @staticmethod
+    def _weigh(counts: Dict[str, int], idf: Callable[[str], float]) -> Dict[str, float]:
+        """计算L2归一化的TF-IDF向量（对数词频）"""
+        vector = {gram: (1 + math.log(count)) * idf(gram) for gram, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {gram: weight / norm for gram, weight in vector.items()}
+
+    def vectorize(self, content: str) -> Dict[str, float]:
+        return self._weigh(self.features(content), lambda gram: self.idf.get(gram, self.default_idf))
+
+    @classmethod
+    def train(cls, documents: List[Tuple[str, List[str]]], min_docs: int = 3,
+              max_features: int = 300) -> 'LocalTagger':
+        """由 (正文, 标签列表) 训练分类器，出现少于min_docs篇的标签被忽略"""
+        counted = [(cls.features(content), tags) for content, tags in documents]
+        doc_freq: Dict[str, int] = {}
+        for counts, _ in counted:
+            for gram in counts:
+                doc_freq[gram] = doc_freq.get(gram, 0) + 1
+        total = len(counted)
+        idf = {gram: math.log((1 + total) / (1 + df)) + 1 for gram, df in doc_freq.items()}
+        default_idf = math.log(1 + total) + 1
+
+        sums: Dict[str, Dict[str, float]] = {}
+        tag_docs: Dict[str, int] = {}
+        for counts, tags in counted:
+            vector = cls._weigh(counts, idf.__getitem__)
+            for tag in set(tags):
+                tag_docs[tag] = tag_docs.get(tag, 0) + 1
+                centroid = sums.setdefault(tag, {})
+                for gram, weight in vector.items():
+                    centroid[gram] = centroid.get(gram, 0.0) + weight
+
+        centroids = {}
+        for tag, centroid in sums.items():
+            if tag_docs[tag] < min_docs:
+                continue
+            top = sorted(centroid.items(), key=lambda item: item[1], reverse=True)[:max_features]
+            norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1.0
+            centroids[tag] = {gram: round(weight / norm, 6) for gram, weight in top}
+        return cls(idf, centroids, default_idf)
+
+    def predict(self, content: str, top_k: int = 7) -> List[Tuple[str, float]]:
+        """返回相似度最高的 (标签, 分数) 列表"""
+        scores: Dict[str, float] = {}
+        for gram, weight in self.vectorize(content).items():
+            for tag, tag_weight in self._postings.get(gram, ()):
+                scores[tag] = scores.get(tag, 0.0) + weight * tag_weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def save(self, path: str):
+        """保存模型（仅保留质心中用到的idf）"""
+        used = {gram for centroid in self.centroids.values() for gram in centroid}
+        model = {
+            "version": 1,
+            "default_idf": self.default_idf,
+            "idf": {gram: round(value, 6) for gram, value in self.idf.items() if gram in used},
+            "centroids": self.centroids
+        }
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(model, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LocalTagger':
+        with open(path, 'r', encoding='utf-8') as f:
+            model = json.load(f)
+        return cls(model["idf"], model["centroids"], model["default_idf"])
+
+
+QUEUE_ORDERS = {
+    "path": lambda item: str(item[0]),
+    "smallest": lambda item: item[1].st_size,
+    "largest": lambda item: -item[1].st_size,
+    "newest": lambda item: -item[1].st_mtime_ns,
+    "oldest": lambda item: item[1].st_mtime_ns,
+}
+
+
+def load_config(config_path: str = None) -> Dict:
+    """加载配置文件，并与默认配置逐级合并"""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))  # 深拷贝默认配置
+    if config_path is None:
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")
+    if not os.path.exists(config_path):
+        return config
+
+    import yaml
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        user_config = yaml.safe_load(f) or {}
+
+    for section, values in user_config.items():
+        if isinstance(values, dict) and isinstance(config.get(section), dict):
+            config[section].update(values)
+        else:
+            config[section] = values
+
+    return config
+
+
 class TrevanPrehandler:
     """TrevanBox AI预处理器"""
 
     def __init__(self, config: Dict = None):
         self.config = config or DEFAULT_CONFIG
-        self.ollama_url = self.config["ollama"]["base_url"]
         self.model = self.config["ollama"]["model"]
         self.timeout = self.config["ollama"]["timeout"]
+        self.concurrency = max(1, int(self.config["processing"].get("concurrency", 1)))
+        # 多个提交线程时串行化文件写入和移动
+        self._write_lock = threading.Lock()
+        self.run_stats: Optional[RunStats] = None
+        self.jobs: Optional[JobQueue] = None
+        self.result_output: Optional[TextIO] = None
+        self._session: Optional['requests.Session'] = None
+        self._session_lock = threading.Lock()
+        self._warm_up_thread: Optional[threading.Thread] = None
+        self.endpoints = EndpointPool.from_config(self.config["ollama"])
+        self.limiter = AdaptiveLimiter.from_config(self.config["limiter"], self.concurrency) \
+            if self.config["limiter"].get("enabled", True) else None
+        self.cache = self._open_cache() if self.config["cache"].get("enabled", True) else None
+        self.manifest = ProcessingManifest(get_state_path("manifest.db")) \
+            if self.config["processing"].get("incremental", True) else None
+        self.tagger = self._load_tagger() if self.config["tagger"].get("enabled", True) else None
+        self.fingerprints = FingerprintIndex(get_state_path("fingerprints.db"), self.config["dedup"]["max_distance"]) \
+            if self.config["dedup"].get("action", "reuse") != "off" else None
+
+    def _open_cache(self) -> Optional[AICache]:
+        """打开AI结果缓存，失败时禁用缓存"""
+        import sqlite3
 
-    def check_ollama_status(self) -> bool:
-        """检查Ollama服务状态"""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+            return AICache.from_config(self.config["cache"])
+        except (sqlite3.Error, OSError) as e:
+            print(f"缓存不可用，已禁用: {e}")
+            return None
+
+    def _tagger_path(self) -> str:
+        return self.config["tagger"].get("path") or get_state_path("tagger.json")
+
+    def _load_tagger(self) -> Optional[LocalTagger]:
+        """加载本地标签分类器，尚未训练或文件损坏时返回None"""
+        path = self._tagger_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            return LocalTagger.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] 本地标签模型加载失败，将由模型生成标签: {e}")
+            return None
+
+    @property
+    def session(self) -> 'requests.Session':
+        """长连接复用的HTTP会话，第一次调用模型时才创建（并导入requests）"""
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+            return self._session
+
+    def _create_session(self) -> 'requests.Session':
+        """创建长连接复用的HTTP会话"""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        pool_size = self.config["ollama"].get("pool_size") or \
+            max(self.concurrency, self.limiter.max_limit if self.limiter else 1)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def warm_up(self):
+        """预先加载模型（空提示词只加载不生成），让模型加载与文件扫描、解析并行"""
+        import requests
+
+        keep_alive = self.config["ollama"].get("keep_alive")
+        for endpoint in self.endpoints.endpoints:
+            if not endpoint.healthy:
+                continue
+            payload = {"model": self.model, "prompt": "", "stream": False}
+            if keep_alive is not None:
+                payload["keep_alive"] = keep_alive
+            try:
+                self.session.post(f"{endpoint.url}/api/generate", json=payload, timeout=max(self.timeout, 120))
+            except requests.RequestException as e:
+                print(f"[WARN] 模型预热失败（{endpoint.url}）: {e}")
+
+    def start_warm_up(self):
+        """在后台预热模型（ollama.warmup关闭或上一次预热尚未结束时不发起）"""
+        if not self.config["ollama"].get("warmup", True):
+            return
+        if self._warm_up_thread and self._warm_up_thread.is_alive():
+            return
+        self._warm_up_thread = threading.Thread(target=self.warm_up, daemon=True)
+        self._warm_up_thread.start()
 
-    def call_ollama(self, prompt: str, system_prompt: str = None) -> str:
-        """调用Ollama模型"""
+    def check_ollama_status(self) -> bool:
+        """检查Ollama服务状态（任一节点可用即为正常）"""
+        available = False
+        for endpoint in self.endpoints.endpoints:
+            endpoint.healthy = self.endpoints.probe(endpoint)
+            available = available or endpoint.healthy
+        return available
+
+    def call_ollama(self, prompt: str, system_prompt: str = None, deadline: Optional[float] = None,
+                    stop_when: Optional[Callable[[str], bool]] = None, response_format: Optional[str] = None,
+                    num_predict: Optional[int] = None, stats: Optional[Dict] = None) -> str:
+        """调用Ollama模型
+
+        超时、连接错误和5xx响应按指数退避（带抖动）重试，deadline为
+        time.monotonic()时间点，超过后不再重试。失败时抛出OllamaError。
+        流式模式下，stop_when对已接收文本返回True时立即断开，释放GPU。
+        response_format为"json"时要求模型输出JSON。
+        stats用于累计耗时、token数和重试次数。
+        """
+        with timed(stats, "llm"):
+            return self._call_ollama(prompt, system_prompt, deadline, stop_when, response_format,
+                                     num_predict, stats)
+
+    def _call_ollama(self, prompt: str, system_prompt: Optional[str], deadline: Optional[float],
+                     stop_when: Optional[Callable[[str], bool]], response_format: Optional[str],
+                     num_predict: Optional[int], stats: Optional[Dict]) -> str:
+        """call_ollama的实现（含重试）"""
+        import requests
+
+        ollama_config = self.config["ollama"]
+        stream = ollama_config.get("stream", True)
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream,
+            "options": {"num_predict": num_predict or self._num_predict()}
         }
 
         if system_prompt:
             payload["system"] = system_prompt
+        if ollama_config.get("think") is not None:
+            payload["think"] = ollama_config["think"]
+        if ollama_config.get("keep_alive") is not None:
+            payload["keep_alive"] = ollama_config["keep_alive"]
+        if response_format:
+            payload["format"] = response_format
+
+        max_retries = ollama_config.get("retry", 3)
+        last_error = None
+        # 令牌桶按每2个字符约1个token预估提示词，加上输出上限
+        estimated_tokens = (len(prompt) + len(system_prompt or "")) // 2 + payload["options"]["num_predict"]
+
+        for attempt in range(max_retries + 1):
+            if attempt:
+                add_stat(stats, "retries", 1)
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise OllamaError(f"超过单文件处理时限: {last_error}")
+                timeout = min(timeout, remaining)
+
+            started = self.limiter.acquire(estimated_tokens, deadline) if self.limiter else None
+            try:
+                endpoint = self.endpoints.acquire(deadline)
+            except EndpointUnavailable as e:
+                last_error = e
+                endpoint = None
+            except OllamaError:
+                if self.limiter:
+                    self.limiter.release(started, None)
+                raise
+
+            ok = False
+            result = {}
+            try:
+                if endpoint is not None:
+                    response = self.session.post(
+                        f"{endpoint.url}/api/generate",
+                        json=payload,
+                        timeout=timeout,
+                        stream=stream
+                    )
+                    with response:
+                        if response.status_code < 500:
+                            ok = True
+                            response.raise_for_status()
+                            generation_started = time.perf_counter()
+                            if stream:
+                                text, result = self._read_stream(response, deadline, stop_when)
+                            else:
+                                result = response.json()
+                                text = result.get("response", "")
+                            self._record_generation(stats, result, time.perf_counter() - generation_started)
+                            if result.get("done_reason") == "length" and \
+                                    not self._output_complete(text, stop_when, response_format):
+                                raise InvalidResponse(
+                                    f"模型输出达到num_predict上限（{payload['options']['num_predict']}）被截断")
+                            return text.strip()
+                        last_error = f"HTTP {response.status_code}"
+            except (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                ok = False
+                last_error = e
+            except (requests.RequestException, ValueError) as e:
+                # 4xx或无法解析的响应，重试无意义
+                ok = None
+                raise OllamaError(f"Ollama调用失败: {e}")
+            except OllamaError:
+                ok = None
+                raise
+            finally:
+                if endpoint is not None:
+                    self.endpoints.release(endpoint, ok is not False)
+                if self.limiter:
+                    # 没有可用节点时不作为负载信号
+                    eval_count, eval_duration = result.get("eval_count"), result.get("eval_duration")
+                    per_token = eval_duration / 1e9 / eval_count if eval_count and eval_duration else None
+                    self.limiter.release(started, ok if endpoint is not None else None, per_token, estimated_tokens,
+                                         result.get("prompt_eval_count", 0) + result.get("eval_count", 0))
+
+            if attempt < max_retries:
+                backoff = min(ollama_config.get("backoff_max", 30.0),
+                              ollama_config.get("backoff_base", 1.0) * (2 ** attempt))
+                backoff *= random.uniform(0.5, 1.0)
+                if deadline is not None:
+                    backoff = min(backoff, max(0.0, deadline - time.monotonic()))
+                time.sleep(backoff)
+
+        raise OllamaError(f"Ollama调用失败（已重试{max_retries}次）: {last_error}")
+
+    def _read_stream(self, response: 'requests.Response', deadline: Optional[float],
+                     stop_when: Optional[Callable[[str], bool]]) -> Tuple[str, Dict]:
+        """逐块读取流式响应，满足stop_when或超过时限时提前结束
+
+        返回 (文本, 统计)；提前结束时没有服务端的token统计，统计为空。
+        """
+        parts = []
+        final = {}
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise OllamaError(f"Ollama调用失败: {chunk['error']}")
+            parts.append(chunk.get("response", ""))
+            if chunk.get("done"):
+                final = chunk
+                break
+
+            text = "".join(parts)
+            if stop_when and stop_when(text):
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise OllamaError("超过单文件处理时限（流式生成未完成）")
+        return "".join(parts), final
+
+    @staticmethod
+    def _record_generation(stats: Optional[Dict], result: Dict, elapsed: float):
+        """记录Ollama返回的token统计（eval_duration缺失时使用实测耗时）
+
+        流式提前结束的调用没有服务端统计，只计入unmetered_calls，不计入token数和生成速度。
+        """
+        add_stat(stats, "llm_calls", 1)
+        if "eval_count" not in result:
+            add_stat(stats, "unmetered_calls", 1)
+            return
+        add_stat(stats, "prompt_tokens", result.get("prompt_eval_count", 0))
+        add_stat(stats, "output_tokens", result.get("eval_count", 0))
+        eval_duration = result.get("eval_duration")
+        add_stat(stats, "eval_seconds", eval_duration / 1e9 if eval_duration else elapsed)
+
+    def _output_complete(self, text: str, stop_when: Optional[Callable[[str], bool]],
+                         response_format: Optional[str]) -> bool:
+        """被num_predict截断的输出是否仍然可用：所需字段齐全、JSON对象完整，或思考文本之外已有正文"""
+        if stop_when:
+            return stop_when(text)
+        body = self._strip_thinking(text).strip()
+        if response_format == "json":
+            try:
+                json.loads(body)
+            except ValueError:
+                return False
+        return bool(body)
+
+    def _num_predict(self, expected: Optional[int] = None) -> int:
+        """输出token上限：预期输出长度的两倍；未关闭思考时另加ai.thinking_tokens
+
+        expected默认为标题、标签、摘要所需长度，此时可用ai.num_predict直接指定。
+        """
+        ai_config = self.config["ai"]
+        if expected is None:
+            if ai_config.get("num_predict"):
+                return ai_config["num_predict"]
+            expected = ai_config["summary_length"] + ai_config["title_max_length"] + ai_config["tags_max_count"] * 5
+        limit = expected * 2 + 64
+        if self.config["ollama"].get("think") is not False:
+            limit += ai_config.get("thinking_tokens", 2048)
+        return limit
+
+    def detect_encoding(self, raw_data: bytes) -> str:
+        """检测非UTF-8文件的编码：只对有限样本运行chardet"""
+        if not self.config["processing"].get("encoding_detection", True):
+            return 'gb18030'
 
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json=payload,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("response", "").strip()
-        except Exception as e:
-            print(f"Ollama调用失败: {e}")
-            return ""
-
-    def detect_encoding(self, file_path: str) -> str:
-        """检测文件编码"""
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                result = chardet.detect(raw_data)
-                encoding = result.get('encoding', 'utf-8')
-                # 处理常见的中文编码
-                if encoding.lower() in ['gb2312', 'gbk']:
-                    return 'gb18030'
-                return encoding or 'utf-8'
+            import chardet
+
+            sample_size = self.config["processing"].get("encoding_sample_size", 64 * 1024)
+            result = chardet.detect(raw_data[:sample_size])
+            encoding = result.get('encoding') or 'utf-8'
+            # 处理常见的中文编码
+            if encoding.lower() in ['gb2312', 'gbk']:
+                return 'gb18030'
+            return encoding
         except:
-            return 'utf-8'
+            return 'gb18030'
 
-    def read_file_content(self, file_path: str) -> Tuple[str, Dict]:
-        """读取文件内容和元数据"""
-        encoding = self.detect_encoding(file_path)
+    def decode_content(self, raw_data: bytes) -> str:
+        """解码文件内容，每种编码最多解码一次
 
+        绝大多数文件是UTF-8，直接严格解码，成功即返回；失败时才检测编码，
+        再依次尝试gb18030和latin-1。
+        """
         try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                content = f.read()
+            return raw_data.decode('utf-8-sig')
         except UnicodeDecodeError:
-            # 尝试其他编码
-            for enc in ['utf-8', 'gb18030', 'latin-1']:
-                try:
-                    with open(file_path, 'r', encoding=enc) as f:
-                        content = f.read()
-                        break
-                except:
-                    continue
-            else:
+            pass
+
+        for encoding in dict.fromkeys([self.detect_encoding(raw_data), 'gb18030', 'latin-1']):
+            try:
+                return raw_data.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+        raise ValueError("无法识别文件编码")
+
+    def read_file_content(self, file_path: str, stats: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """读取文件内容和元数据
+
+        文件只读取一次，编码检测和解码都基于内存中的字节，UTF-8文件只解码一次。
+        """
+        with timed(stats, "read"):
+            max_size = self.config["processing"].get("max_file_size")
+            file_size = os.path.getsize(file_path)
+            if max_size and file_size > max_size:
+                raise ValueError(f"文件过大（{file_size}字节，上限{max_size}字节）: {file_path}")
+
+            with open(file_path, 'rb') as f:
+                raw_data = f.read()
+
+        with timed(stats, "decode"):
+            try:
+                content = self.decode_content(raw_data)
+            except ValueError:
                 raise ValueError(f"无法解码文件: {file_path}")
 
+            # 与文本模式读取一致，统一换行符
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+
         # 解析YAML frontmatter
         metadata = {}
         body_content = content
 
         if content.startswith('---'):
-            try:
-                parts = content.split('---', 2)
-                if len(parts) >= 3:
-                    metadata_str = parts[1].strip()
-                    body_content = parts[2].strip()
-                    metadata = yaml.safe_load(metadata_str) or {}
-            except:
-                pass
+            with timed(stats, "frontmatter"):
+                try:
+                    import yaml
+
+                    parts = content.split('---', 2)
+                    if len(parts) >= 3:
+                        metadata_str = parts[1].strip()
+                        body_content = parts[2].strip()
+                        metadata = yaml.safe_load(metadata_str) or {}
+                except:
+                    pass
 
         return body_content, metadata
 
@@ -174,6 +1508,8 @@ class TrevanPrehandler:
         try:
             # 构建新的内容
             if metadata:
+                import yaml
+
                 yaml_content = yaml.dump(metadata, allow_unicode=True, default_flow_style=False, sort_keys=False)
                 new_content = f"---\n{yaml_content}---\n\n{content}"
             else:
@@ -211,8 +1547,7 @@ class TrevanPrehandler:
         """移动文件到待处理目录"""
         try:
             # 获取项目根目录
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            vault_root = os.path.dirname(os.path.dirname(script_dir))
+            vault_root = get_vault_root()
             inbox_dir = os.path.join(vault_root, "0-Inbox", "pending")
 
             # 确保目标目录存在
@@ -297,7 +1632,8 @@ class TrevanPrehandler:
         elif metadata["tags"] is None:
             cleaned["tags"] = []
         else:
-            cleaned["tags"] = metadata["tags"]
+            # 复制一份，添加来源标签时不修改调用方的元数据
+            cleaned["tags"] = list(metadata["tags"])
 
         # 添加来源标签
         dir_name = os.path.basename(source_dir.rstrip('/'))
@@ -327,79 +1663,336 @@ class TrevanPrehandler:
 
         return ordered_metadata
 
-    def generate_all_ai_content(self, content: str, current_title: str = "", existing_tags: List[str] = []) -> Tuple[str, List[str], str]:
-        """一次性生成标题、标签和描述"""
-        # 如果已有合适标题，直接使用
-        if current_title and len(current_title) <= self.config["ai"]["title_max_length"]:
-            # 只生成标签和描述
-            prompt = f"""请分析以下内容并返回结构化结果：
+    def generate_all_ai_content(self, content: str, current_title: str = "", existing_tags: List[str] = [],
+                                deadline: Optional[float] = None, stats: Optional[Dict] = None) -> Tuple[str, List[str], str]:
+        """一次性生成标题、标签和描述
 
-内容：
-{content[:2000]}
+        本地标签分类器有足够把握时，标签由分类器给出，模型只生成标题和描述。
+        模型调用失败或响应缺少字段时抛出OllamaError，不会写入默认值。
+        """
+        # 如果已有合适标题，直接使用
+        with_title = self._needs_title(current_title)
+        local_tags = self.local_tags(content, stats)
+        fields = (["标题"] if with_title else []) + ([] if local_tags else ["标签"]) + ["描述"]
+
+        parsed = self._generate_fields(content, fields, deadline, stats)
+        if local_tags:
+            parsed = dict(parsed, tags=local_tags)
+        return self._finish_ai_result(parsed, current_title, existing_tags)
+
+    def local_tags(self, content: str, stats: Optional[Dict] = None) -> List[str]:
+        """本地分类器给出的标签；候选不足tagger.min_tags个时返回空列表"""
+        if not self.tagger:
+            return []
+        tagger_config = self.config["tagger"]
+        with timed(stats, "tagger"):
+            predictions = self.tagger.predict(content, self.config["ai"]["tags_max_count"])
+        tags = [tag for tag, score in predictions if score >= tagger_config.get("min_score", 0.2)]
+        return tags if len(tags) >= tagger_config.get("min_tags", 2) else []
+
+    def suggest_tags(self, content: str, existing_tags: List[str],
+                     deadline: Optional[float] = None) -> Tuple[List[str], str]:
+        """只生成标签，返回 (标签, 来源)；本地分类器把握不足时调用模型"""
+        local_tags = self.local_tags(content)
+        if local_tags:
+            return self._validate_and_clean_tags(local_tags, existing_tags), "本地"
+        parsed = self._generate_fields(content, ["标签"], deadline)
+        return self._validate_and_clean_tags(parsed["tags"], existing_tags), "模型"
+
+    @staticmethod
+    def _system_prompt(fields: List[str]) -> str:
+        """按字段组合生成系统提示词
+
+        固定的指令放在系统提示词中、笔记内容放在用户提示词中，
+        同类请求共享相同的前缀，服务端可以复用已计算的提示词缓存。
+        """
+        formats = "\n".join(f"{field}：{FIELD_FORMATS[field]}" for field in fields)
+        rules = "\n".join(f"- {rule}" for field in fields for rule in FIELD_RULES[field])
+        return f"""请分析用户提供的内容并返回结构化结果。
 
 请按以下格式返回结果：
-标签：[3-7个中文标签，每个标签不超过4个字，用逗号分隔]
-描述：[100-200字中文总结，突出核心观点]
+{formats}
 
 要求：
-- 标签要相关且具体，每个标签不超过4个字
-- 英文标签全部小写，避免重复
-- 描述要结构化，包含核心观点和关键信息
+{rules}
 
 请严格按格式返回，不要添加其他说明。"""
-        else:
-            # 生成所有内容
-            prompt = f"""请分析以下内容并返回结构化结果：
 
-内容：
-{content[:2000]}
+    def _generate_fields(self, content: str, fields: List[str], deadline: Optional[float] = None,
+                         stats: Optional[Dict] = None) -> Dict:
+        """调用模型生成指定字段，返回 {title, tags, description}（带缓存）
+
+        长文档先分段摘要，再基于摘要生成。响应为空或缺少所需字段时抛出InvalidResponse，
+        这样的结果不写入缓存。
+        """
+        variant = PROMPT_VARIANTS[tuple(fields)]
+        source = "内容"
+        if self._is_long_document(content):
+            content = self.summarize_long_document(content, deadline, stats)
+            variant += "_reduce"
+            source = "长文档各部分的摘要（按原文顺序）"
+        else:
+            content = content[:2000]
+
+        cache_key = None
+        if self.cache:
+            with timed(stats, "cache"):
+                cache_key = AICache.make_key(self.model, variant, content)
+                cached = self.cache.get(cache_key)
+            # 早期版本可能缓存了字段缺失的结果，视为未命中
+            if cached is not None and not self._missing_fields(cached, fields):
+                if stats is not None:
+                    stats["cache_hit"] = True
+                return cached
+
+        prompt = f"{source}：\n{content}"
+        response = self.call_ollama(prompt, self._system_prompt(fields), deadline=deadline,
+                                    stop_when=lambda text: self._response_complete(text, fields), stats=stats)
+        if not response:
+            raise InvalidResponse("模型返回空响应")
 
-请按以下格式返回结果：
-标题：[8-15字中文标题]
-标签：[3-7个中文标签，每个标签不超过4个字，用逗号分隔]
-描述：[100-200字中文总结，突出核心观点]
+        # 解析结构化响应
+        title, tags, description = self._parse_ai_response(response)
+        parsed = {"title": title, "tags": tags, "description": description}
+        missing = self._missing_fields(parsed, fields)
+        if missing:
+            raise InvalidResponse(f"模型响应缺少字段: {'、'.join(missing)}")
+        if self.cache:
+            self.cache.set(cache_key, self.model, variant, parsed)
+        return parsed
+
+    def _is_long_document(self, content: str) -> bool:
+        """判断是否走长文档（分段摘要）模式"""
+        ai_config = self.config["ai"]
+        return ai_config.get("long_doc_enabled", True) and len(content) > ai_config.get("long_doc_threshold", 6000)
+
+    def summarize_long_document(self, content: str, deadline: Optional[float] = None,
+                                stats: Optional[Dict] = None) -> str:
+        """将长文档分段并行摘要，返回按原文顺序拼接的分段摘要
+
+        分段摘要按分段内容缓存，文档修改后只需重新摘要变化的分段。
+        拼接结果仍超过长文档阈值时再汇总一轮。
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        ai_config = self.config["ai"]
+        threshold = ai_config.get("long_doc_threshold", 6000)
+        chunk_size = ai_config.get("chunk_size", 3000)
+        workers = max(1, ai_config.get("chunk_workers", 2))
+
+        text = content
+        for _ in range(3):
+            chunks = split_into_chunks(text, chunk_size)
+            chunk_stats = [{} if stats is not None else None for _ in chunks]
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                summaries = list(executor.map(
+                    lambda args: self._summarize_chunk(args[0], deadline, args[1]), zip(chunks, chunk_stats)
+                ))
+            for item in chunk_stats:
+                merge_stats(stats, item)
+            add_stat(stats, "chunks", len(chunks))
+
+            text = "\n\n".join(f"【第{index}部分】{summary}" for index, summary in enumerate(summaries, 1))
+            if len(text) <= threshold:
+                break
+        return text[:threshold]
+
+    def _summarize_chunk(self, chunk: str, deadline: Optional[float], stats: Optional[Dict]) -> str:
+        """摘要单个分段（带缓存）"""
+        cache_key = None
+        if self.cache:
+            with timed(stats, "cache"):
+                cache_key = AICache.make_key(self.model, "chunk", chunk)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached["summary"]
+
+        length = self.config["ai"].get("chunk_summary_length", 150)
+        system_prompt = f"请用不超过{length}字的中文概括用户提供的文档片段的要点，只输出摘要。"
+        response = self.call_ollama(chunk, system_prompt, deadline=deadline, num_predict=self._num_predict(length),
+                                    stats=stats)
+        summary = self._strip_thinking(response).strip()
+        if not summary:
+            raise InvalidResponse("分段摘要为空")
+        if self.cache:
+            self.cache.set(cache_key, self.model, "chunk", {"summary": summary})
+        return summary
+
+    @staticmethod
+    def _batch_system_prompt(fields: List[str]) -> str:
+        """按批内笔记所需的字段生成合批请求的系统提示词"""
+        schema = ", ".join(BATCH_FIELD_SCHEMA[field] for field in fields)
+        rules = "\n".join(f"- {BATCH_FIELD_RULES[field]}" for field in fields)
+        return f"""请分别分析用户提供的每篇笔记，为每篇生成{'、'.join(fields)}。
+
+请返回JSON对象，格式如下：
+{{"notes": [{{"id": 1, {schema}}}]}}
 
 要求：
-- 标题简洁准确，反映内容主题
-- 标签要相关且具体，每个标签不超过4个字
-- 英文标签全部小写，避免重复
-- 描述要结构化，包含核心观点和关键信息
-
-请严格按格式返回，不要添加其他说明。"""
-
-        response = self.call_ollama(prompt)
-        if not response:
-            # 调用失败，返回默认值
-            default_title = current_title if current_title else "未命名文档"
-            return default_title, existing_tags, ""
+- 每篇笔记对应一个条目，id与笔记编号一致
+{rules}"""
+
+    def generate_batch_ai_content(self, items: List[Tuple[str, str, List[str]]], deadline: Optional[float] = None,
+                                  stats_list: Optional[List[Dict]] = None) -> List[Tuple[str, List[str], str]]:
+        """将多篇短笔记合并为一次JSON结构化请求
+
+        items为(content, current_title, existing_tags)列表，返回值与之一一对应。
+        响应无法解析、缺少某篇笔记或某篇笔记的字段为空时，对应笔记回退为单篇调用。
+        stats_list与items对应；合批请求的耗时计入每篇笔记，token数平均分摊。
+        本地标签分类器有足够把握的笔记不向模型请求标签；批内所有笔记都不需要某个字段时，
+        该字段不出现在请求的JSON格式中。
+        """
+        stats_list = stats_list or [None] * len(items)
+        results: List[Optional[Tuple[str, List[str], str]]] = [None] * len(items)
+        pending = []
+
+        for index, (content, current_title, existing_tags) in enumerate(items):
+            local_tags = self.local_tags(content, stats_list[index])
+            fields = (["标题"] if self._needs_title(current_title) else []) + ([] if local_tags else ["标签"]) + ["描述"]
+            variant = PROMPT_VARIANTS[tuple(fields)]
+            with timed(stats_list[index], "cache"):
+                cache_key = AICache.make_key(self.model, variant, content[:2000])
+                cached = self.cache.get(cache_key) if self.cache else None
+            if cached is not None and not self._missing_fields(cached, fields):
+                if stats_list[index] is not None:
+                    stats_list[index]["cache_hit"] = True
+                if local_tags:
+                    cached = dict(cached, tags=local_tags)
+                results[index] = self._finish_ai_result(cached, current_title, existing_tags)
+            else:
+                pending.append((index, fields, cache_key, local_tags))
 
-        # 解析结构化响应
-        title, tags, description = self._parse_ai_response(response, current_title)
+        parsed_notes = {}
+        if len(pending) > 1:
+            notes_text = "\n\n".join(
+                f"【笔记{note_id}】\n{items[index][0][:2000]}"
+                for note_id, (index, _, _, _) in enumerate(pending, 1)
+            )
+            prompt = f"以下共{len(pending)}篇笔记：\n\n{notes_text}"
+            batch_fields = [field for field in FIELD_KEYS if any(field in fields for _, fields, _, _ in pending)]
+            batch_stats = {}
+            try:
+                response = self.call_ollama(prompt, self._batch_system_prompt(batch_fields), deadline=deadline,
+                                            response_format="json",
+                                            num_predict=self._num_predict() * len(pending), stats=batch_stats)
+                parsed_notes = self._parse_batch_response(response)
+            except OllamaError as e:
+                print(f"批量调用失败，回退为单篇处理: {e}")
+            self._share_batch_stats(batch_stats, [stats_list[index] for index, _, _, _ in pending])
+
+        for note_id, (index, fields, cache_key, local_tags) in enumerate(pending, 1):
+            content, current_title, existing_tags = items[index]
+            parsed = parsed_notes.get(note_id)
+            if parsed is None or self._missing_fields(parsed, fields):
+                results[index] = self.generate_all_ai_content(content, current_title, existing_tags, deadline,
+                                                              stats_list[index])
+                continue
+
+            if "标题" not in fields:
+                parsed["title"] = ""
+            if "标签" not in fields:
+                parsed["tags"] = []
+            if self.cache:
+                self.cache.set(cache_key, self.model, PROMPT_VARIANTS[tuple(fields)], parsed)
+            if local_tags:
+                parsed = dict(parsed, tags=local_tags)
+            results[index] = self._finish_ai_result(parsed, current_title, existing_tags)
 
-        # 验证和清理标签
-        validated_tags = self._validate_and_clean_tags(tags, existing_tags)
+        return results
 
-        return title, validated_tags, description
+    @staticmethod
+    def _share_batch_stats(batch_stats: Dict, stats_list: List[Optional[Dict]]):
+        """把合批请求的统计分配给每篇笔记：耗时计全额，token数和重试次数平均分摊"""
+        for stats in stats_list:
+            if stats is None:
+                continue
+            stats["batch_size"] = len(stats_list)
+            for stage, seconds in batch_stats.get("timings", {}).items():
+                timings = stats.setdefault("timings", {})
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            for key in ("prompt_tokens", "output_tokens", "eval_seconds", "retries"):
+                add_stat(stats, key, batch_stats.get(key, 0) / len(stats_list))
+
+    def _parse_batch_response(self, response: str) -> Dict[int, Dict]:
+        """解析批量JSON响应，返回 {笔记编号: {title, tags, description}}，格式不符的条目被丢弃"""
+        try:
+            data = json.loads(self._strip_thinking(response))
+        except ValueError:
+            return {}
+
+        notes = data.get("notes", []) if isinstance(data, dict) else data
+        if not isinstance(notes, list):
+            return {}
+
+        parsed = {}
+        for note in notes:
+            if not isinstance(note, dict):
+                continue
+            try:
+                note_id = int(note.get("id"))
+            except (TypeError, ValueError):
+                continue
+
+            tags = note.get("tags", [])
+            if isinstance(tags, str):
+                tags = tags.split(',')
+            if not isinstance(tags, list) or not isinstance(note.get("description"), str):
+                continue
+            parsed[note_id] = {
+                "title": str(note.get("title") or "").strip(),
+                "tags": [str(tag).strip() for tag in tags if str(tag).strip()],
+                "description": note["description"].strip()
+            }
+        return parsed
+
+    @staticmethod
+    def _missing_fields(parsed: Dict, fields: List[str]) -> List[str]:
+        """解析结果中缺失或为空的字段"""
+        return [field for field in fields if not parsed.get(FIELD_KEYS[field])]
+
+    def _needs_title(self, current_title: str) -> bool:
+        """是否需要由模型生成标题（无标题或标题过长）"""
+        return not (current_title and len(current_title) <= self.config["ai"]["title_max_length"])
+
+    def _finish_ai_result(self, parsed: Dict, current_title: str, existing_tags: List[str]) -> Tuple[str, List[str], str]:
+        """由解析结果得到最终的标题、标签和描述"""
+        title = parsed["title"] or current_title
+        return title, self._validate_and_clean_tags(parsed["tags"], existing_tags), parsed["description"]
+
+    @staticmethod
+    def _strip_thinking(response: str) -> str:
+        """去除模型的思考文本（<think>...</think>，包括尚未结束的思考块）"""
+        response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
+        return response.split('<think>', 1)[0]
+
+    def _response_complete(self, response: str, fields: List[str]) -> bool:
+        """判断流式响应中所需字段是否都已完整输出"""
+        response = self._strip_thinking(response)
+        return all(
+            re.search(rf'{field}：[ \t]*(?:\[[^\]]+\]|[^\[\n][^\n]*\n)', response)
+            for field in fields
+        )
 
     def _parse_ai_response(self, response: str, current_title: str = "") -> Tuple[str, List[str], str]:
         """解析AI返回的结构化结果"""
         title = current_title
         tags = []
         description = ""
+        response = self._strip_thinking(response)
 
         # 提取标题 - 支持两种格式：有方括号和没有方括号
-        title_match = re.search(r'标题：\s*(?:\[([^\]]+)\]|([^\n]+))', response)
+        title_match = re.search(r'标题：[ \t]*(?:\[([^\]]+)\]|([^\n]+))', response)
         if title_match:
             title = (title_match.group(1) or title_match.group(2)).strip()
 
         # 提取标签 - 支持两种格式
-        tags_match = re.search(r'标签：\s*(?:\[([^\]]+)\]|([^\n]+))', response)
+        tags_match = re.search(r'标签：[ \t]*(?:\[([^\]]+)\]|([^\n]+))', response)
         if tags_match:
             tags_str = (tags_match.group(1) or tags_match.group(2)).strip()
             tags = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
 
         # 提取描述 - 支持两种格式
-        desc_match = re.search(r'描述：\s*(?:\[([^\]]+)\]|([^\n]+))', response)
+        desc_match = re.search(r'描述：[ \t]*(?:\[([^\]]+)\]|([^\n]+))', response)
         if desc_match:
             description = (desc_match.group(1) or desc_match.group(2)).strip()
 
@@ -441,57 +2034,169 @@ class TrevanPrehandler:
 
     def process_file(self, file_path: str, source_dir: str, dry_run: bool = False, move_to_inbox: bool = False) -> Dict:
         """处理单个文件"""
-        result = {
-            "file": file_path,
-            "success": False,
-            "changes": {},
-            "error": None
-        }
+        job = {"file": file_path, "source_dir": source_dir}
+        return self._run_unit([job], dry_run, move_to_inbox)[0]
+
+    def _prepare_job(self, job: Dict):
+        """读取文件并清理元数据，结果保存在job中"""
+        job.setdefault("stats", {"timings": {}})
+        content, metadata = self.read_file_content(job["file"], job["stats"])
+        new_metadata = self.clean_metadata(metadata, job["source_dir"])
+        job.update({
+            "content": content,
+            "metadata": metadata,
+            "new_metadata": new_metadata,
+            "current_title": metadata.get("title", ""),
+            "current_tags": new_metadata.get("tags", [])
+        })
+
+    def _check_duplicate(self, job: Dict) -> Optional[Dict]:
+        """计算job的指纹并查找重复笔记
+
+        返回None表示需要正常处理；否则返回跳过的结果（dedup.action为skip），
+        或带有复用AI结果的 {"ai_result": ...}（dedup.action为reuse）。
+        """
+        dedup = self.config["dedup"]
+        text = normalize_text(job["content"])
+        # 正文过短（如只有frontmatter）时不检测重复，否则所有空正文的笔记都会被视为重复
+        if len(text) < dedup.get("min_chars", 200):
+            return None
+        exact, simhash = compute_fingerprint(text, dedup.get("shingle_size", 4))
+        job["fingerprint"] = (exact, simhash)
+
+        match = self.fingerprints.find(job["file"], exact, simhash)
+        if match is None:
+            return None
+        if dedup.get("action") == "skip":
+            return {"file": job["file"], "success": True, "skipped": True, "changes": {}, "error": None,
+                    "reason": f"与{match['path']}重复", "duplicate_of": match["path"], "stats": job.get("stats")}
+        # 只复用标签和描述；标题不跨文件复制，需要生成标题的笔记照常调用模型
+        reused = match["result"]
+        if not reused or not reused.get("description") or self._needs_title(job["current_title"]):
+            return None
+
+        parsed = {"title": "", "tags": reused.get("tags", []), "description": reused["description"]}
+        job["duplicate_of"] = match["path"]
+        return {"ai_result": self._finish_ai_result(parsed, job["current_title"], job["current_tags"])}
+
+    def _record_fingerprint(self, job: Dict, ai_result: Tuple[str, List[str], str], result: Dict):
+        """记录已处理笔记的指纹和AI结果（不含标题；标签不含原有标签，便于其他目录的副本复用）"""
+        exact, simhash = job["fingerprint"]
+        _, tags, description = ai_result
+        if result.get("moved"):
+            self.fingerprints.remove(job["file"])
+        self.fingerprints.record(result["file"], exact, simhash, {
+            "tags": [tag for tag in tags if tag not in job["current_tags"]],
+            "description": description
+        })
+
+    def _run_unit(self, jobs: List[Dict], dry_run: bool, move_to_inbox: bool) -> List[Dict]:
+        """同步处理一个工作单元：单个文件，或一批合并请求的短笔记"""
+        results = [self._new_result(job) for job in jobs]
 
         try:
-            # 读取文件
-            content, metadata = self.read_file_content(file_path)
-
-            # 清理元数据
-            new_metadata = self.clean_metadata(metadata, source_dir)
+            for job in jobs:
+                if "content" not in job:
+                    self._prepare_job(job)
+            ai_results = self._infer_unit(jobs)
+        except Exception as e:
+            # 失败的文件不写入；模型调用失败的文件由_mark_failed标记为可重试
+            for result in results:
+                self._mark_failed(result, e)
+            return results
 
-            # 使用统一AI处理函数
-            current_title = metadata.get("title", "")
-            current_tags = new_metadata.get("tags", [])
+        for job, ai_result, result in zip(jobs, ai_results, results):
+            try:
+                self._commit_job(job, ai_result, result, dry_run, move_to_inbox)
+            except Exception as e:
+                self._mark_failed(result, e)
 
-            new_title, new_tags, description = self.generate_all_ai_content(
-                content, current_title, current_tags
-            )
+        return results
 
-            new_metadata["title"] = new_title
-            # 合并AI标签和现有标签（包含目录标签），确保目录标签保留
-            # 保留目录标签，合并AI标签
-            existing_tags_with_directory = new_metadata.get("tags", [])
-            merged_tags = self._validate_and_clean_tags(new_tags, existing_tags_with_directory)
-            new_metadata["tags"] = merged_tags
-            new_metadata["description"] = description
-
-            # 检测变化
-            changes = {}
-            if metadata != new_metadata:
-                changes["metadata"] = {
-                    "old": metadata,
-                    "new": new_metadata
-                }
-
-            if description:
-                changes["description"] = description
-
-            result["changes"] = changes
-
-            # 写入文件（如果不是预览模式）
-            if not dry_run and changes:
-                if self.write_file_content(file_path, new_metadata, content):
+    @staticmethod
+    def _new_result(job: Dict) -> Dict:
+        """创建文件处理结果（与job共享计时统计）"""
+        return {"file": job["file"], "success": False, "changes": {}, "error": None, "stats": job.get("stats")}
+
+    @staticmethod
+    def _mark_failed(result: Dict, error: Exception):
+        """记录失败原因，模型调用失败的文件标记为可重试"""
+        result["error"] = str(error)
+        if isinstance(error, OllamaError):
+            result["retryable"] = True
+
+    def _infer_unit(self, jobs: List[Dict]) -> List[Tuple[str, List[str], str]]:
+        """为已解析的工作单元调用模型（使用统一AI处理函数）"""
+        deadline = time.monotonic() + self._unit_deadline(jobs)
+        if len(jobs) == 1:
+            job = jobs[0]
+            return [self.generate_all_ai_content(
+                job["content"], job["current_title"], job["current_tags"], deadline, job.get("stats")
+            )]
+        return self.generate_batch_ai_content(
+            [(job["content"], job["current_title"], job["current_tags"]) for job in jobs], deadline,
+            [job.get("stats") for job in jobs]
+        )
+
+    def _unit_deadline(self, jobs: List[Dict]) -> float:
+        """工作单元的模型调用时限（秒）：ollama.file_deadline，长文档按分段摘要的轮数另加ai.chunk_deadline"""
+        seconds = self.config["ollama"].get("file_deadline", 300)
+        if len(jobs) == 1 and self._is_long_document(jobs[0]["content"]):
+            ai_config = self.config["ai"]
+            chunks = len(split_into_chunks(jobs[0]["content"], ai_config.get("chunk_size", 3000)))
+            rounds = math.ceil(chunks / max(1, ai_config.get("chunk_workers", 2)))
+            seconds += rounds * ai_config.get("chunk_deadline", 60)
+        return seconds
+
+    def _commit_job(self, job: Dict, ai_result: Tuple[str, List[str], str], result: Dict,
+                    dry_run: bool, move_to_inbox: bool):
+        """合并AI结果、检测变化并写入文件
+
+        标题或描述为空的结果抛出InvalidResponse：不写入文件，也不在清单中记为已处理，
+        文件按失败处理，可以用retry-failed重试。
+        """
+        file_path = job["file"]
+        content = job["content"]
+        metadata = job["metadata"]
+        new_metadata = job["new_metadata"]
+        new_title, new_tags, description = ai_result
+        if not new_title or not description:
+            raise InvalidResponse("AI结果缺少标题或描述，未写入")
+
+        new_metadata["title"] = new_title
+        # 合并AI标签和现有标签（包含目录标签），确保目录标签保留
+        # 保留目录标签，合并AI标签
+        existing_tags_with_directory = new_metadata.get("tags", [])
+        merged_tags = self._validate_and_clean_tags(new_tags, existing_tags_with_directory)
+        new_metadata["tags"] = merged_tags
+        new_metadata["description"] = description
+
+        # 检测变化
+        changes = {}
+        if metadata != new_metadata:
+            changes["metadata"] = {
+                "old": metadata,
+                "new": new_metadata
+            }
+
+        if description:
+            changes["description"] = description
+
+        result["changes"] = changes
+
+        # 写入文件（如果不是预览模式）
+        stats = job.get("stats")
+        if not dry_run and changes:
+            with self._write_lock:
+                with timed(stats, "write"):
+                    written = self.write_file_content(file_path, new_metadata, content)
+                if written:
                     result["success"] = True
 
                     # 如果启用了移动到待处理目录且处理成功
                     if move_to_inbox and result["success"]:
-                        new_file_path = self.move_file_to_inbox(file_path)
+                        with timed(stats, "move"):
+                            new_file_path = self.move_file_to_inbox(file_path)
                         if new_file_path != file_path:  # 移动成功
                             result["file"] = new_file_path
                             result["moved"] = True
@@ -499,63 +2204,636 @@ class TrevanPrehandler:
                             result["moved"] = False
                 else:
                     result["error"] = "文件写入失败"
-            else:
-                result["success"] = True  # 预览模式也视为成功
+        else:
+            result["success"] = True  # 预览模式也视为成功
 
-        except Exception as e:
-            result["error"] = str(e)
+        if self.manifest and result["success"] and not dry_run:
+            with timed(stats, "manifest"):
+                if result.get("moved"):
+                    self.manifest.remove(file_path)
+                else:
+                    self.manifest.record(file_path)
+
+        if self.fingerprints and job.get("fingerprint") and result["success"] and not dry_run:
+            self._record_fingerprint(job, ai_result, result)
+        if job.get("duplicate_of"):
+            result["duplicate_of"] = job["duplicate_of"]
+
+    def _batchable(self, job: Dict) -> bool:
+        """是否可以与其他短笔记合批请求"""
+        ai_config = self.config["ai"]
+        return ai_config.get("batch_enabled", True) and \
+            len(job["content"]) <= ai_config.get("batch_max_note_chars", 800)
+
+    def _run_pipeline(self, md_files: List[Path], directory: str, dry_run: bool, move_to_inbox: bool):
+        """三阶段流水线：解析 → 推理 → 提交，按文件顺序产出 (文件序号, 结果)
+
+        阶段之间使用有界队列，下游繁忙时上游阻塞。合批和并发请求可能让后面的文件先完成，
+        已进入流水线和完成后等待按序输出的文件合计不超过queue_size的3倍：排在最前的文件
+        较慢时暂停送入新文件，内存占用与导入规模无关。
+        """
+        import queue
+
+        processing = self.config["processing"]
+        parse_workers = max(1, int(processing.get("parse_workers", 2)))
+        # 自适应并发时推理线程数按上限准备，实际并发由limiter控制
+        infer_workers = max(self.concurrency, self.limiter.max_limit) if self.limiter else self.concurrency
+        commit_workers = max(1, int(processing.get("commit_workers", 1)))
+        queue_size = max(1, int(processing.get("queue_size", 32)))
+
+        # 与三个阶段队列的总容量一致，不限制正常情况下的流水线深度
+        window = threading.Semaphore(queue_size * 3)
+        path_q = queue.Queue(maxsize=queue_size)
+        parse_q = queue.Queue(maxsize=queue_size)
+        commit_q = queue.Queue(maxsize=queue_size)
+        result_q = queue.Queue(maxsize=queue_size)
+
+        def emit(job: Dict, result: Dict):
+            """输出结果，附带从开始解析到处理结束的耗时"""
+            result["elapsed"] = time.monotonic() - job["started"]
+            result_q.put((job["index"], result))
+
+        def fail(job: Dict, error: Exception):
+            """输出失败结果（每个文件只记录一次）"""
+            result = self._new_result(job)
+            self._mark_failed(result, error)
+            emit(job, result)
+
+        def feed():
+            for index, md_file in enumerate(md_files):
+                window.acquire()
+                path_q.put({"index": index, "file": str(md_file), "source_dir": directory})
+            for _ in range(parse_workers):
+                path_q.put(_SENTINEL)
+
+        def parse():
+            while True:
+                job = path_q.get()
+                if job is _SENTINEL:
+                    return
+                job["started"] = time.monotonic()
+                # 任何异常都要输出失败结果，否则按序输出会一直等待这个文件
+                try:
+                    if self.jobs and not dry_run:
+                        self.jobs.start(job["file"])
+                    self._prepare_job(job)
+                    duplicate = self._check_duplicate(job) if self.fingerprints else None
+                except Exception as e:
+                    fail(job, e)
+                    continue
+                if duplicate is None:
+                    parse_q.put(job)
+                elif "ai_result" in duplicate:
+                    commit_q.put((job, duplicate["ai_result"]))
+                else:
+                    emit(job, duplicate)
+
+        def infer():
+            ai_config = self.config["ai"]
+            carry = None
+            while True:
+                if carry is not None:
+                    job, carry = carry, None
+                else:
+                    job = parse_q.get()
+                if job is _SENTINEL:
+                    return
+
+                # 短笔记：从队列中顺带取出已就绪的短笔记合批
+                unit = [job]
+                if self._batchable(job):
+                    batch_chars = len(job["content"])
+                    while len(unit) < ai_config.get("batch_max_notes", 8):
+                        try:
+                            next_job = parse_q.get_nowait()
+                        except queue.Empty:
+                            break
+                        if next_job is _SENTINEL or not self._batchable(next_job) or \
+                                batch_chars + len(next_job["content"]) > ai_config.get("batch_char_budget", 4000):
+                            carry = next_job
+                            break
+                        unit.append(next_job)
+                        batch_chars += len(next_job["content"])
 
-        return result
+                try:
+                    ai_results = self._infer_unit(unit)
+                except Exception as e:
+                    for unit_job in unit:
+                        fail(unit_job, e)
+                    continue
+                for unit_job, ai_result in zip(unit, ai_results):
+                    commit_q.put((unit_job, ai_result))
+
+        def commit():
+            while True:
+                item = commit_q.get()
+                if item is _SENTINEL:
+                    return
+                job, ai_result = item
+                result = self._new_result(job)
+                try:
+                    self._commit_job(job, ai_result, result, dry_run, move_to_inbox)
+                except Exception as e:
+                    self._mark_failed(result, e)
+                emit(job, result)
 
-    def process_directory(self, directory: str, dry_run: bool = False, move_to_inbox: bool = False) -> List[Dict]:
-        """处理目录中的所有markdown文件"""
-        results = []
+        def start_stage(target, count: int, downstream: queue.Queue, downstream_count: int):
+            """启动一个阶段；最后退出的线程向下游发送结束标记"""
+            remaining = [count]
+            lock = threading.Lock()
 
+            def run():
+                try:
+                    target()
+                finally:
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        for _ in range(downstream_count):
+                            downstream.put(_SENTINEL)
+
+            for _ in range(count):
+                threading.Thread(target=run, daemon=True).start()
+
+        threading.Thread(target=feed, daemon=True).start()
+        start_stage(parse, parse_workers, parse_q, infer_workers)
+        start_stage(infer, infer_workers, commit_q, commit_workers)
+        start_stage(commit, commit_workers, result_q, 1)
+
+        finished = {}
+        next_index = 0
+        while True:
+            item = result_q.get()
+            if item is _SENTINEL:
+                return
+            index, result = item
+            finished[index] = result
+            while next_index in finished:
+                result = finished.pop(next_index)
+                window.release()
+                yield next_index, result
+                next_index += 1
+
+    def process_directory(self, directory: str, dry_run: bool = False, move_to_inbox: bool = False,
+                          force: bool = False, since: Optional[datetime.datetime] = None) -> List[Dict]:
+        """处理目录中的所有markdown文件
+
+        force为True时忽略增量清单；since用于只处理该时间之后修改的文件。
+        被跳过的文件以 skipped=True 的结果返回，不逐个输出。
+        大规模导入请使用iter_process_directory，结果不会全部留在内存中。
+        """
+        return list(self.iter_process_directory(directory, dry_run, move_to_inbox, force, since))
+
+    def iter_process_directory(self, directory: str, dry_run: bool = False, move_to_inbox: bool = False,
+                               force: bool = False, since: Optional[datetime.datetime] = None) -> Iterator[Dict]:
+        """逐个产出目录中文件的处理结果（生成器），参数含义同process_directory"""
         if not os.path.exists(directory):
             print(f"目录不存在: {directory}")
-            return results
+            return
+
+        md_files = sorted(Path(directory).glob("**/*.md"))
+        yield from self.iter_process_files(md_files, directory, dry_run, move_to_inbox, force, since)
+
+    def process_files(self, files: List[Path], directory: str, dry_run: bool = False, move_to_inbox: bool = False,
+                      force: bool = False, since: Optional[datetime.datetime] = None) -> List[Dict]:
+        """处理导入目录directory中的指定文件，参数含义同process_directory"""
+        return list(self.iter_process_files(files, directory, dry_run, move_to_inbox, force, since))
+
+    def iter_process_files(self, files: List[Path], directory: str, dry_run: bool = False,
+                           move_to_inbox: bool = False, force: bool = False,
+                           since: Optional[datetime.datetime] = None) -> Iterator[Dict]:
+        """逐个产出指定文件的处理结果（生成器）
+
+        被跳过的文件在扫描时立即产出；其余文件按processing.queue_order排序后进入流水线，
+        结果按该顺序产出。启用任务队列时记录每个文件的处理状态，设置了result_output时
+        每个结果同时写为一行JSON。
+        """
+        candidates = []
+        since_ts = since.timestamp() if since else None
+        for md_file in files:
+            stat = md_file.stat()
+            if since_ts is not None and stat.st_mtime < since_ts:
+                skip_reason = "早于--since"
+            elif not force and self.manifest and self.manifest.is_unchanged(str(md_file), stat):
+                skip_reason = "未变化"
+            else:
+                candidates.append((md_file, stat))
+                continue
+            if self.jobs and not dry_run:
+                self.jobs.finish(str(md_file))
+            yield self._output_result({"file": str(md_file), "success": True, "skipped": True,
+                                       "changes": {}, "error": None, "reason": skip_reason})
+
+        order = self.config["processing"].get("queue_order", "path")
+        candidates.sort(key=QUEUE_ORDERS.get(order, QUEUE_ORDERS["path"]))
+        md_files = [md_file for md_file, _ in candidates]
+        del candidates
+        # 确实有文件需要处理时才加载模型，cron定时调用没有新文件时不会占用显存
+        if md_files:
+            self.start_warm_up()
+        if self.jobs and not dry_run:
+            self.jobs.enqueue(directory, md_files)
+
+        for index, result in self._run_pipeline(md_files, directory, dry_run, move_to_inbox):
+            if self.jobs and not dry_run:
+                self.jobs.finish(str(md_files[index]), None if result["success"] else result["error"])
+            if self.run_stats:
+                self.run_stats.add(result)
+            print(f"处理文件: {md_files[index]}")
+            self._report_result(result, dry_run)
+            yield self._output_result(result)
+
+    def _output_result(self, result: Dict) -> Dict:
+        """把结果写入result_output（JSONL，逐行刷新便于tail查看进度）"""
+        if self.result_output:
+            self.result_output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            self.result_output.flush()
+        return result
 
-        md_files = list(Path(directory).glob("**/*.md"))
+    def train_tagger(self) -> Tuple[int, int]:
+        """用仓库中笔记的frontmatter标签训练本地标签分类器，返回 (训练笔记数, 标签数)
+
+        来源目录标签由目录决定、与内容无关，不参与训练。
+        """
+        vault_root = get_vault_root()
+        directory_tags = {mapping["tag"] for mapping in DIRECTORY_MAPPING.values()}
+        documents = []
+        for root, dirs, files in os.walk(vault_root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != 'scripts')
+            for name in sorted(files):
+                if not name.endswith('.md'):
+                    continue
+                file_path = os.path.join(root, name)
+                # 单篇笔记格式异常时跳过，不中断整个仓库的训练
+                try:
+                    content, metadata = self.read_file_content(file_path)
+                    if not isinstance(metadata, dict):
+                        continue
+                    tags = [tag.strip().lower() if tag.isascii() else tag.strip()
+                            for tag in frontmatter_tags(metadata) if tag not in directory_tags]
+                except Exception as e:
+                    print(f"  [ERROR] {file_path}: {e}")
+                    continue
+                if tags and content.strip():
+                    documents.append((content, tags))
 
-        for md_file in md_files:
-            print(f"处理文件: {md_file}")
-            result = self.process_file(str(md_file), directory, dry_run, move_to_inbox)
+        tagger_config = self.config["tagger"]
+        self.tagger = LocalTagger.train(documents, tagger_config.get("min_docs", 3),
+                                        tagger_config.get("max_features", 300))
+        self.tagger.save(self._tagger_path())
+        return len(documents), len(self.tagger.centroids)
+
+    def tag_directory(self, directory: str, dry_run: bool = False) -> List[Dict]:
+        """只为目录中的笔记补充标签（优先使用本地分类器），不修改标题和描述"""
+        results = []
+        for md_file in sorted(Path(directory).glob("**/*.md")):
+            file_path = str(md_file)
+            result = {"file": file_path, "success": False, "changes": {}, "error": None}
+            try:
+                content, metadata = self.read_file_content(file_path)
+                existing_tags = self.clean_metadata(metadata, directory).get("tags", [])
+                tags, source = self.suggest_tags(content, existing_tags)
+                result["source"] = source
+                if tags != metadata.get("tags"):
+                    result["changes"]["tags"] = {"old": metadata.get("tags"), "new": tags}
+                    metadata["tags"] = tags
+                    if not dry_run and not self.write_file_content(file_path, metadata, content):
+                        raise OSError("文件写入失败")
+                result["success"] = True
+            except Exception as e:
+                result["error"] = str(e)
             results.append(result)
+        return results
 
-            if result["success"]:
-                if dry_run:
-                    print(f"  [OK] 预览完成")
-                else:
-                    if result.get("moved"):
-                        print(f"  [OK] 处理完成并移动到待处理目录")
-                    else:
-                        print(f"  [OK] 处理完成")
+    def index_fingerprints(self) -> int:
+        """为所有导入目录和0-Inbox/pending中的笔记建立指纹索引，返回索引的笔记数
+
+        正文过短的笔记不建索引；已有描述的笔记同时记录其标签和描述，供之后导入的副本复用。
+        """
+        vault_root = get_vault_root()
+        directories = [os.path.join(vault_root, name) for name in DIRECTORY_MAPPING]
+        directories.append(os.path.join(vault_root, "0-Inbox", "pending"))
+        directory_tags = {mapping["tag"] for mapping in DIRECTORY_MAPPING.values()}
+        shingle_size = self.config["dedup"].get("shingle_size", 4)
+        min_chars = self.config["dedup"].get("min_chars", 200)
+
+        indexed = 0
+        for directory in directories:
+            for md_file in sorted(Path(directory).glob("**/*.md")):
+                # 单篇笔记格式异常时跳过，不中断整个索引过程
+                try:
+                    content, metadata = self.read_file_content(str(md_file))
+                    if not isinstance(metadata, dict):
+                        metadata = {}
+                    text = normalize_text(content)
+                    if len(text) < min_chars:
+                        continue
+                    exact, simhash = compute_fingerprint(text, shingle_size)
+                    result = None
+                    description = metadata.get("description")
+                    if isinstance(description, str) and description.strip():
+                        result = {
+                            "tags": [tag for tag in frontmatter_tags(metadata) if tag not in directory_tags],
+                            "description": description
+                        }
+                    self.fingerprints.record(str(md_file), exact, simhash, result)
+                except Exception as e:
+                    print(f"  [ERROR] {md_file}: {e}")
+                    continue
+                indexed += 1
+        return indexed
+
+    def _report_result(self, result: Dict, dry_run: bool):
+        """输出单个文件的处理结果"""
+        if result.get("skipped"):
+            print(f"  [SKIP] 跳过: {result['reason']}")
+            return
+        if result.get("duplicate_of"):
+            print(f"  [DUP] 复用重复笔记的AI结果: {result['duplicate_of']}")
+        if result["success"]:
+            if dry_run:
+                print(f"  [OK] 预览完成")
             else:
-                print(f"  [ERROR] 失败: {result['error']}")
+                if result.get("moved"):
+                    print(f"  [OK] 处理完成并移动到待处理目录")
+                else:
+                    print(f"  [OK] 处理完成")
+        else:
+            print(f"  [ERROR] 失败: {result['error']}")
+
+
+class ImportWatcher:
+    """监视导入目录，新增或变化的markdown文件写入稳定后自动处理
+
+    安装了watchdog时使用inotify等系统事件，否则按poll_interval轮询
+    文件的大小和修改时间。webdav和Syncthing会分块写入文件，因此文件
+    需要在settle_seconds内保持不变才会进入处理队列。
+    """
+
+    # 同步工具的临时文件和编辑器交换文件
+    IGNORED_PATTERNS = ['.*', '~*', '*.tmp', '*.part', '*.crdownload', '*.sync-conflict-*']
+
+    def __init__(self, prehandler: TrevanPrehandler, directories: List[str],
+                 dry_run: bool = False, move_to_inbox: bool = False):
+        watch_config = prehandler.config["watch"]
+        self.prehandler = prehandler
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.dry_run = dry_run
+        self.move_to_inbox = move_to_inbox
+        self.poll_interval = watch_config.get("poll_interval", 5)
+        self.settle_seconds = watch_config.get("settle_seconds", 5)
+        self.use_inotify = watch_config.get("use_inotify", True)
+        self._events = set()
+        self._events_lock = threading.Lock()
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._pending: Dict[str, Tuple[int, int, float]] = {}  # 路径 → (大小, 修改时间, 最后变化时间)
+        # 监视器自己写入的文件 → 写入后的(大小, 修改时间)，忽略由此产生的变化，
+        # 未启用增量清单时也不会反复处理同一文件
+        self._written: Dict[str, Tuple[int, int]] = {}
+
+    def _is_candidate(self, path: str) -> bool:
+        """是否为需要处理的markdown文件"""
+        name = os.path.basename(path)
+        if not name.endswith('.md'):
+            return False
+        return not any(fnmatch.fnmatch(name, pattern) for pattern in self.IGNORED_PATTERNS)
+
+    def _source_dir(self, path: str) -> Optional[str]:
+        """文件所属的导入目录"""
+        for directory in self.directories:
+            if path.startswith(directory + os.sep):
+                return directory
+        return None
+
+    def _scan(self) -> List[str]:
+        """轮询扫描：只比较文件大小和修改时间，返回新增或变化的文件"""
+        changed = []
+        snapshot = {}
+        for directory in self.directories:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in files:
+                    path = os.path.join(root, name)
+                    if not self._is_candidate(path):
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+                    if self._snapshot.get(path) != snapshot[path]:
+                        changed.append(path)
+        self._snapshot = snapshot
+        return changed
+
+    def _start_observer(self):
+        """启动文件系统事件监听，watchdog未安装时返回None"""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                path = getattr(event, 'dest_path', None) or event.src_path
+                if watcher._is_candidate(path):
+                    with watcher._events_lock:
+                        watcher._events.add(os.path.abspath(path))
+
+        observer = Observer()
+        for directory in self.directories:
+            observer.schedule(Handler(), directory, recursive=True)
+        observer.start()
+        return observer
+
+    def _drain_events(self) -> List[str]:
+        """取出事件监听收集到的文件"""
+        with self._events_lock:
+            paths, self._events = list(self._events), set()
+        return paths
+
+    def _update_pending(self, paths: List[str]):
+        """记录变化的文件，大小或修改时间再次变化时重新计时"""
+        now = time.monotonic()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._pending.pop(path, None)
+                continue
+            if self._written.get(path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            self._written.pop(path, None)
+            previous = self._pending.get(path)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+    def _pop_ready(self) -> Dict[str, List[Path]]:
+        """取出已稳定的文件，按导入目录分组"""
+        now = time.monotonic()
+        ready: Dict[str, List[Path]] = {}
+        for path, (size, mtime_ns, changed_at) in list(self._pending.items()):
+            if now - changed_at < self.settle_seconds:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                continue
+            del self._pending[path]
+            directory = self._source_dir(path)
+            if directory:
+                ready.setdefault(directory, []).append(Path(path))
+        return ready
+
+    def _remember_written(self, result: Dict):
+        """记录处理后写回原位置的文件"""
+        if self.dry_run or not result["success"] or result.get("skipped") or result.get("moved"):
+            return
+        path = os.path.abspath(result["file"])
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self._written[path] = (stat.st_size, stat.st_mtime_ns)
 
-        return results
+    def run(self):
+        """持续监视，直到Ctrl-C"""
+        observer = self._start_observer() if self.use_inotify else None
+        mode = "文件系统事件" if observer else f"轮询（每{self.poll_interval}秒）"
+        print(f"开始监视 {len(self.directories)} 个目录，模式: {mode}，按Ctrl-C停止")
+
+        # 启动时补处理已有文件，清单中未变化的文件会被跳过
+        self._update_pending(self._scan())
+        next_poll = time.monotonic() + self.poll_interval
+
+        try:
+            while True:
+                if observer:
+                    self._update_pending(self._drain_events())
+                elif time.monotonic() >= next_poll:
+                    self._update_pending(self._scan())
+                    next_poll = time.monotonic() + self.poll_interval
+
+                for directory, files in self._pop_ready().items():
+                    processed = []
+                    for result in self.prehandler.iter_process_files(sorted(files), directory,
+                                                                     self.dry_run, self.move_to_inbox):
+                        self._remember_written(result)
+                        if not result.get("skipped"):
+                            processed.append(result["success"])
+                    if processed:
+                        print(f"[{datetime.datetime.now():%H:%M:%S}] {directory}: 完成 {sum(processed)}/{len(processed)} 个文件")
+
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\n停止监视")
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+
+
+def resolve_directories(dir_args: List[str]) -> List[str]:
+    """解析目录参数：all展开为全部导入目录，导入目录名映射到仓库根目录下"""
+    directories = []
+    for dir_arg in dir_args:
+        if dir_arg == 'all':
+            directories.extend(DIRECTORY_MAPPING.keys())
+        else:
+            directories.append(dir_arg)
+
+    return [os.path.join('..', '..', directory) if directory in DIRECTORY_MAPPING else directory
+            for directory in directories]
+
+
+def default_timing_log(config: Dict) -> str:
+    """当天的计时日志路径（同一天的运行追加到同一文件），并删除超过保留天数的日志"""
+    instrumentation = config["instrumentation"]
+    log_dir = instrumentation.get("log_dir") or os.path.join(get_vault_root(), STATE_DIR_NAME, "logs")
+    retention_days = instrumentation.get("retention_days")
+    if retention_days and os.path.isdir(log_dir):
+        cutoff = time.time() - retention_days * 86400
+        for name in os.listdir(log_dir):
+            path = os.path.join(log_dir, name)
+            if fnmatch.fnmatch(name, "prehandler-*.jsonl") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    return os.path.join(log_dir, f"prehandler-{datetime.date.today():%Y%m%d}.jsonl")
+
+
+def parse_since(value: str) -> datetime.datetime:
+    """解析--since参数"""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的日期: {value}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="TrevanBox AI预处理器")
+    parser.add_argument('--config', help='配置文件路径（默认为脚本目录下的config.yaml）')
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
 
     # status命令
     status_parser = subparsers.add_parser('status', help='检查系统状态')
 
+    # process和watch命令共用的处理选项
+    processing_options = argparse.ArgumentParser(add_help=False)
+    processing_options.add_argument('directories', nargs='+', help='要处理的目录')
+    processing_options.add_argument('--dry-run', action='store_true', help='预览模式')
+    processing_options.add_argument('--move-to-inbox', action='store_true', help='处理完成后移动到待处理目录')
+    processing_options.add_argument('--workers', type=int, help='推理阶段的并发请求数（覆盖processing.concurrency）')
+    processing_options.add_argument('--parse-workers', type=int, help='解析阶段的线程数（覆盖processing.parse_workers）')
+    processing_options.add_argument('--commit-workers', type=int, help='写入阶段的线程数（覆盖processing.commit_workers）')
+    processing_options.add_argument('--no-cache', action='store_true', help='不使用AI结果缓存')
+    processing_options.add_argument('--timing-log', help='逐文件计时JSONL日志路径（默认写入.trevanbox/logs）')
+    processing_options.add_argument('--order', choices=sorted(QUEUE_ORDERS),
+                                    help='处理顺序（覆盖processing.queue_order）')
+    processing_options.add_argument('--output', help='把逐文件处理结果以JSONL流式写入该文件（追加）')
+
     # process命令
-    process_parser = subparsers.add_parser('process', help='处理导入目录')
-    process_parser.add_argument('directories', nargs='+', help='要处理的目录')
-    process_parser.add_argument('--dry-run', action='store_true', help='预览模式')
-    process_parser.add_argument('--move-to-inbox', action='store_true', help='处理完成后移动到待处理目录')
+    process_parser = subparsers.add_parser('process', parents=[processing_options], help='处理导入目录')
+    process_parser.add_argument('--force', action='store_true', help='忽略增量清单，重新处理所有文件')
+    process_parser.add_argument('--since', type=parse_since, help='只处理该日期之后修改的文件（YYYY-MM-DD或ISO时间）')
+    process_parser.add_argument('--resume', action='store_true', help='从上次中断处继续，只处理未完成的文件')
+
+    # retry-failed命令
+    subparsers.add_parser('retry-failed', parents=[processing_options], help='只重新处理上次失败的文件')
+
+    # watch命令
+    watch_parser = subparsers.add_parser('watch', parents=[processing_options], help='监视导入目录并自动处理新文件')
+    watch_parser.add_argument('--poll', action='store_true', help='强制使用轮询模式')
+
+    # cache命令
+    cache_parser = subparsers.add_parser('cache', help='管理AI结果缓存')
+    cache_parser.add_argument('action', choices=['stats', 'clear', 'evict'], help='缓存操作')
+
+    # dedup命令
+    dedup_parser = subparsers.add_parser('dedup', help='管理重复笔记指纹索引')
+    dedup_parser.add_argument('action', choices=['index', 'stats'],
+                              help='index: 为导入目录和0-Inbox/pending中的笔记建立指纹索引')
 
     # title命令
     title_parser = subparsers.add_parser('title', help='生成标题')
     title_parser.add_argument('directories', nargs='+', help='要处理的目录')
 
     # tags命令
-    tags_parser = subparsers.add_parser('tags', help='生成标签')
+    tags_parser = subparsers.add_parser('tags', help='只生成标签（优先使用本地标签分类器）')
     tags_parser.add_argument('directories', nargs='+', help='要处理的目录')
+    tags_parser.add_argument('--dry-run', action='store_true', help='预览模式')
+
+    # tagger命令
+    tagger_parser = subparsers.add_parser('tagger', help='管理本地标签分类器')
+    tagger_parser.add_argument('action', choices=['train', 'stats'], help='train: 用仓库中已有笔记的标签训练')
 
     # summary命令
     summary_parser = subparsers.add_parser('summary', help='生成总结')
@@ -563,43 +2841,161 @@ def main():
 
     args = parser.parse_args()
 
-    prehandler = TrevanPrehandler()
+    config = load_config(args.config)
+    if getattr(args, 'workers', None):
+        config["processing"]["concurrency"] = args.workers
+    if getattr(args, 'parse_workers', None):
+        config["processing"]["parse_workers"] = args.parse_workers
+    if getattr(args, 'commit_workers', None):
+        config["processing"]["commit_workers"] = args.commit_workers
+    if getattr(args, 'order', None):
+        config["processing"]["queue_order"] = args.order
+    if getattr(args, 'no_cache', False) or args.command not in ('process', 'retry-failed', 'watch', 'tags'):
+        config["cache"]["enabled"] = False
+    if args.command not in ('process', 'retry-failed', 'watch'):
+        config["processing"]["incremental"] = False
+    if args.command not in ('process', 'retry-failed', 'watch', 'dedup'):
+        config["dedup"]["action"] = "off"
+    if args.command not in ('process', 'retry-failed', 'watch', 'tags'):
+        config["tagger"]["enabled"] = False
+    if getattr(args, 'poll', False):
+        config["watch"]["use_inotify"] = False
+
+    prehandler = TrevanPrehandler(config)
+    if args.command in ('process', 'retry-failed', 'watch') and config["instrumentation"].get("enabled", True):
+        prehandler.run_stats = RunStats(args.timing_log or default_timing_log(config))
+    if args.command in ('process', 'retry-failed'):
+        prehandler.jobs = JobQueue(get_state_path("jobs.db"))
+    if getattr(args, 'output', None):
+        prehandler.result_output = open(args.output, 'a', encoding='utf-8')
 
     if args.command == 'status':
         print("检查系统状态...")
         if prehandler.check_ollama_status():
             print("[OK] Ollama服务正常")
             print(f"[OK] 使用模型: {prehandler.model}")
+            for endpoint in prehandler.endpoints.endpoints:
+                state = "[OK]" if endpoint.healthy else "[ERROR]"
+                print(f"{state} 节点: {endpoint.url}（权重 {endpoint.weight:g}）")
         else:
             print("[ERROR] Ollama服务不可用")
             print("请确保Ollama服务正在运行: ollama serve")
-
-    elif args.command == 'process':
-        directories = []
-        for dir_arg in args.directories:
-            if dir_arg == 'all':
-                directories.extend(DIRECTORY_MAPPING.keys())
-            else:
-                directories.append(dir_arg)
-
-        for directory in directories:
-            if directory in DIRECTORY_MAPPING:
-                dir_path = os.path.join('..', '..', directory)
-            else:
-                dir_path = directory
-
+        jobs_path = get_state_path("jobs.db", create=False)
+        if os.path.exists(jobs_path):
+            counts = JobQueue(jobs_path).counts()
+            print(f"任务队列: 待处理 {counts['pending']}，进行中 {counts['in_progress']}，"
+                  f"完成 {counts['done']}，失败 {counts['failed']}")
+
+    elif args.command in ('process', 'retry-failed'):
+        failed = []
+        for dir_path in resolve_directories(args.directories):
             print(f"\n处理目录: {dir_path}")
             if args.move_to_inbox:
                 print("  [MOVE] 处理完成后将移动到待处理目录")
-            results = prehandler.process_directory(dir_path, args.dry_run, args.move_to_inbox)
-
-            success_count = sum(1 for r in results if r["success"])
-            moved_count = sum(1 for r in results if r.get("moved"))
-            print(f"完成: {success_count}/{len(results)} 个文件")
+            if args.command == 'retry-failed' or args.resume:
+                states = ["failed"] if args.command == 'retry-failed' else ["pending", "in_progress"]
+                files = prehandler.jobs.files(dir_path, states)
+                if not files:
+                    print("  没有需要处理的文件")
+                    continue
+                label = "[RETRY] 重试失败的" if args.command == 'retry-failed' else "[RESUME] 继续处理未完成的"
+                print(f"  {label} {len(files)} 个文件")
+                results = prehandler.iter_process_files(files, dir_path, args.dry_run, args.move_to_inbox,
+                                                        force=getattr(args, 'force', False))
+            else:
+                if not args.dry_run:
+                    prehandler.jobs.reset(dir_path)
+                results = prehandler.iter_process_directory(dir_path, args.dry_run, args.move_to_inbox,
+                                                            force=args.force, since=args.since)
+
+            # 逐个消费结果，只保留计数和失败文件，内存占用与文件数无关
+            success_count = processed_count = skipped_count = moved_count = 0
+            for r in results:
+                if r.get("skipped"):
+                    skipped_count += 1
+                    continue
+                processed_count += 1
+                success_count += r["success"]
+                moved_count += bool(r.get("moved"))
+                if r.get("retryable"):
+                    failed.append((r["file"], r["error"]))
+            print(f"完成: {success_count}/{processed_count} 个文件")
+            if skipped_count:
+                print(f"跳过: {skipped_count} 个文件")
             if moved_count > 0:
                 print(f"移动: {moved_count}/{success_count} 个文件到待处理目录")
 
-    elif args.command in ['title', 'tags', 'summary']:
+        if prehandler.run_stats:
+            prehandler.run_stats.print_summary()
+        if prehandler.limiter and prehandler.limiter.max_limit > prehandler.limiter.min_limit:
+            print(prehandler.limiter.summary())
+
+        if failed:
+            print(f"\n模型调用失败的文件（{len(failed)}个，未写入，运行retry-failed即可只重试这些文件）:")
+            for file, error in failed:
+                print(f"  {file}: {error}")
+
+    elif args.command == 'watch':
+        directories = [d for d in resolve_directories(args.directories) if os.path.isdir(d)]
+        if not directories:
+            print("没有可监视的目录")
+            return
+        ImportWatcher(prehandler, directories, args.dry_run, args.move_to_inbox).run()
+        if prehandler.run_stats:
+            prehandler.run_stats.print_summary()
+        if prehandler.limiter and prehandler.limiter.max_limit > prehandler.limiter.min_limit:
+            print(prehandler.limiter.summary())
+
+    elif args.command == 'cache':
+        cache = AICache.from_config(config["cache"])
+        if args.action == 'clear':
+            print(f"[OK] 已清空缓存: {cache.clear()} 条")
+        elif args.action == 'evict':
+            print(f"[OK] 已淘汰过期缓存: {cache.evict()} 条")
+        else:
+            stats = cache.stats()
+            print(f"缓存文件: {stats['path']}")
+            print(f"条目数: {stats['entries']}")
+            print(f"大小: {stats['size_bytes'] / 1024:.1f} KB")
+
+    elif args.command == 'dedup':
+        if not prehandler.fingerprints:
+            print("[ERROR] 重复检测已关闭（dedup.action: off）")
+        elif args.action == 'index':
+            print(f"[OK] 已索引: {prehandler.index_fingerprints()} 个笔记")
+        else:
+            print(f"指纹索引: {prehandler.fingerprints.db_path}")
+            print(f"笔记数: {prehandler.fingerprints.count()}")
+
+    elif args.command == 'tagger':
+        if args.action == 'train':
+            documents, tags = prehandler.train_tagger()
+            print(f"[OK] 已训练: {documents} 篇笔记，{tags} 个标签")
+            print(f"模型文件: {prehandler._tagger_path()}")
+        else:
+            tagger = prehandler._load_tagger()
+            if tagger is None:
+                print("本地标签分类器尚未训练，请先运行: python prehandler.py tagger train")
+            else:
+                print(f"模型文件: {prehandler._tagger_path()}")
+                print(f"标签数: {len(tagger.centroids)}")
+
+    elif args.command == 'tags':
+        if not prehandler.tagger:
+            print("[WARN] 本地标签分类器尚未训练，所有标签将由模型生成（python prehandler.py tagger train）")
+        for dir_path in resolve_directories(args.directories):
+            print(f"\n处理目录: {dir_path}")
+            results = prehandler.tag_directory(dir_path, args.dry_run)
+            for result in results:
+                if result["error"]:
+                    print(f"  [ERROR] {result['file']}: {result['error']}")
+                elif result["changes"]:
+                    print(f"  [TAG] {result['file']}（{result['source']}）: {', '.join(result['changes']['tags']['new'])}")
+            sources = [r.get("source") for r in results]
+            print(f"完成: {sum(1 for r in results if r['success'])}/{len(results)} 个文件，"
+                  f"本地分类器: {sources.count('本地')}，模型: {sources.count('模型')}")
+
+    elif args.command in ['title', 'summary']:
         print(f"{args.command}功能正在开发中...")
 
     else:
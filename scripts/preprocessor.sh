@@ -7,6 +7,9 @@
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_ROOT="$(dirname "$SCRIPT_DIR")"
 PREHANDLER_PY="$SCRIPT_DIR/ollama/prehandler.py"
+VENV_PYTHON="$PROJECT_ROOT/.venv/bin/python"
+# 依赖检查通过后写入的标记文件，pyproject.toml未变化时跳过检查
+DEPS_STAMP="$PROJECT_ROOT/.venv/.trevanbox-deps-ok"
 
 # 颜色定义
 RED='\033[0;31m'
@@ -61,7 +64,10 @@ check_dependencies() {
         exit 1
     fi
 
-    # 检查并安装Python依赖
+    # 检查并安装Python依赖（标记文件比pyproject.toml新时跳过，避免每次启动Python）
+    if [ -f "$DEPS_STAMP" ] && [ "$DEPS_STAMP" -nt "$PROJECT_ROOT/pyproject.toml" ]; then
+        return 0
+    fi
     print_info "检查Python依赖..."
     if ! uv run --project "$PROJECT_ROOT" python -c "import requests, yaml, chardet" 2>/dev/null; then
         print_warning "正在安装Python依赖..."
@@ -74,32 +80,14 @@ check_dependencies() {
         fi
     fi
 
+    touch "$DEPS_STAMP"
     print_success "依赖检查完成"
 }
 
 # 检查Ollama服务
 check_ollama() {
     print_info "检查Ollama服务..."
-    if uv run --project "$PROJECT_ROOT" python -c "
-import requests
-try:
-    response = requests.get('http://localhost:11434/api/tags', timeout=5)
-    if response.status_code == 200:
-        print('[OK] Ollama服务正常')
-        models = response.json().get('models', [])
-        if models:
-            print(f'[OK] 可用模型: {len(models)}个')
-        else:
-            print('[WARNING] 未找到可用模型，请确保已下载模型')
-    else:
-        print('[ERROR] Ollama服务响应异常')
-except Exception as e:
-    print(f'[ERROR] 无法连接Ollama服务: {e}')
-"; then
-        return 0
-    else
-        return 1
-    fi
+    execute_uv_command "$(build_uv_command) status"
 }
 
 # 显示帮助信息
@@ -113,10 +101,13 @@ TrevanBox AI预处理器 - 基于uv的现代化版本
   status                  检查系统状态（Ollama服务、模型等）
   process <目录>         处理指定目录中的文件
   process all            处理所有导入目录
+  watch <目录|all>        监视导入目录，新文件同步完成后自动处理
+  retry-failed <目录|all> 只重新处理上次失败的文件
 
 选项:
   --dry-run              预览模式，不实际修改文件
   --move-to-inbox        处理完成后移动到待处理目录(0-Inbox/pending/)
+  --resume               从上次中断处继续（仅process）
   --help, -h             显示此帮助信息
 
 支持的导入目录:
@@ -133,6 +124,8 @@ TrevanBox AI预处理器 - 基于uv的现代化版本
   ./scripts/preprocessor.sh process manual --dry-run
   ./scripts/preprocessor.sh process all --move-to-inbox
   ./scripts/preprocessor.sh process follow clippings --move-to-inbox
+  ./scripts/preprocessor.sh watch all --move-to-inbox
+  ./scripts/preprocessor.sh process all --move-to-inbox --resume
 
 工作流程:
   1. AI分析内容，生成标题、标签、描述
@@ -144,8 +137,12 @@ EOF
 
 # 构建uv命令
 build_uv_command() {
-    local cmd="uv run --project \"$PROJECT_ROOT\" python \"$PREHANDLER_PY\""
-    echo "$cmd"
+    # 虚拟环境已就绪时直接调用其中的Python，省去每次uv run的解析和同步开销
+    if [ -x "$VENV_PYTHON" ]; then
+        echo "\"$VENV_PYTHON\" \"$PREHANDLER_PY\""
+    else
+        echo "uv run --project \"$PROJECT_ROOT\" python \"$PREHANDLER_PY\""
+    fi
 }
 
 # 执行uv命令
@@ -168,10 +165,11 @@ main() {
     local directories=()
     local dry_run=false
     local move_to_inbox=false
+    local resume=false
 
     while [[ $# -gt 0 ]]; do
         case $1 in
-            status|process)
+            status|process|watch|retry-failed)
                 command="$1"
                 shift
                 ;;
@@ -183,6 +181,10 @@ main() {
                 move_to_inbox=true
                 shift
                 ;;
+            --resume)
+                resume=true
+                shift
+                ;;
             --help|-h)
                 show_help
                 exit 0
@@ -214,7 +216,7 @@ main() {
             print_header "系统状态检查"
             check_ollama
             ;;
-        process)
+        process|watch|retry-failed)
             if [ ${#directories[@]} -eq 0 ]; then
                 print_error "请指定要处理的目录"
                 show_help
@@ -225,7 +227,7 @@ main() {
 
             # 构建uv命令
             local uv_cmd=$(build_uv_command)
-            uv_cmd="$uv_cmd process"
+            uv_cmd="$uv_cmd $command"
 
             # 添加目录参数
             for dir in "${directories[@]}"; do
@@ -245,6 +247,16 @@ main() {
                 print_info "处理后将移动到: 0-Inbox/pending/"
             fi
 
+            # 只有process支持--resume，其他子命令传入会被argparse拒绝
+            if [ "$resume" = true ]; then
+                if [ "$command" = process ]; then
+                    uv_cmd="$uv_cmd --resume"
+                    print_info "从上次中断处继续"
+                else
+                    print_warning "--resume 仅适用于process，已忽略"
+                fi
+            fi
+
             echo
             print_info "执行命令: $uv_cmd"
             echo